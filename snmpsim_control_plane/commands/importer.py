@@ -16,6 +16,10 @@ from snmpsim_control_plane import error
 from snmpsim_control_plane import log
 from snmpsim_control_plane.metrics import app
 from snmpsim_control_plane.metrics import db
+from snmpsim_control_plane.metrics import generation
+from snmpsim_control_plane.metrics import manager
+from snmpsim_control_plane.metrics import migrations
+from snmpsim_control_plane.metrics import plans
 from snmpsim_control_plane.metrics import reader
 from snmpsim_control_plane.metrics import models  # noqa
 
@@ -48,6 +52,25 @@ def parse_args():
              'This switch makes sense only when running this tool for the '
              'first time.')
 
+    parser.add_argument(
+        '--upgrade-db',
+        action='store_true',
+        help='Bring existing metrics DB up to date with this version of the '
+             'software. Previously collected metrics are preserved.')
+
+    parser.add_argument(
+        '--purge-db',
+        action='store_true',
+        help='Remove metrics not updated within configured retention '
+             'periods and exit. Metrics importer also does that '
+             'periodically while running.')
+
+    parser.add_argument(
+        '--check-query-plans',
+        action='store_true',
+        help='Check that metrics DB indexes serve REST API search terms '
+             'and exit.')
+
     parser.add_argument(
         '--config', type=str,
         help='Config file path. Can also be set via environment variable '
@@ -75,6 +98,18 @@ def parse_args():
         '--watch-dir', metavar='<DIR>', type=str,
         help='Location of the metrics JSON files to import and remove.')
 
+    parser.add_argument(
+        '--watch-method', choices=reader.WATCH_METHODS,
+        type=str, default='poll',
+        help='How to notice new metrics files: by periodically scanning '
+             'watch directory or through Linux inotify events.')
+
+    parser.add_argument(
+        '--workers', metavar='<NUMBER>', type=int, default=1,
+        help='Number of metrics importer processes to run. Metrics files '
+             'coming from the same producer are always handled by the same '
+             'process.')
+
     return parser.parse_args()
 
 
@@ -89,9 +124,15 @@ def main():
     if args.recreate_db:
         db.drop_all()
         db.create_all()
+        generation.bump()
         return 0
 
-    if not args.watch_dir:
+    if args.upgrade_db:
+        migrations.upgrade_db()
+        return 0
+
+    if (not args.watch_dir and not args.purge_db and
+            not args.check_query_plans):
         sys.stderr.write('ERROR: --watch-dir must be specified\r\n')
         return 1
 
@@ -105,6 +146,20 @@ def main():
         sys.stderr.write('%s\r\n' % exc)
         return 1
 
+    if args.purge_db:
+        manager.purge_metrics()
+        return 0
+
+    if args.check_query_plans:
+        try:
+            report = plans.check_query_plans()
+
+        except error.ControlPlaneError as exc:
+            log.error(exc)
+            return 1
+
+        return 1 if any(report.values()) else 0
+
     if args.daemonize:
         try:
             daemon.daemonize(args.pid_file)
@@ -114,7 +169,13 @@ def main():
                 'ERROR: cant daemonize process: %s\r\n' % exc)
             return 1
 
-    reader.watch_metrics(args.watch_dir)
+    try:
+        reader.watch_metrics(
+            args.watch_dir, method=args.watch_method, workers=args.workers)
+
+    except error.ControlPlaneError as exc:
+        log.error(exc)
+        return 1
 
     return 0
 
@@ -12,6 +12,8 @@ import sys
 
 from snmpsim_control_plane.metrics import app
 from snmpsim_control_plane.metrics import db
+from snmpsim_control_plane.metrics import generation
+from snmpsim_control_plane.metrics import migrations
 from snmpsim_control_plane.metrics import views  # noqa
 
 DESCRIPTION = """\
@@ -34,6 +36,13 @@ def parse_args():
              'This switch makes sense only when running this tool for the '
              'first time.')
 
+    parser.add_argument(
+        '--upgrade-db',
+        action='store_true',
+        help='Bring existing REST API server DB up to date with this '
+             'version of the software. Previously collected metrics are '
+             'preserved.')
+
     parser.add_argument(
         '--config', type=str,
         help='Config file path. Can also be set via environment variable '
@@ -73,6 +82,11 @@ def main():
     if args.recreate_db:
         db.drop_all()
         db.create_all()
+        generation.bump()
+        return 0
+
+    if args.upgrade_db:
+        migrations.upgrade_db()
         return 0
 
     app.run(host=app.config.get('SNMPSIM_METRICS_LISTEN_IP'),
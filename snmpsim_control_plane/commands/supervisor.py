@@ -31,6 +31,12 @@ simulator configuration management tool.
 """
 
 
+def _parse_grace_period(value):
+    pattern, _, seconds = value.rpartition(':')
+
+    return pattern or None, float(seconds)
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description=DESCRIPTION)
 
@@ -60,6 +66,28 @@ def parse_args():
         '--watch-dir', metavar='<DIR>', type=str, required=True,
         help='Location of the executables to herd.')
 
+    parser.add_argument(
+        '--watch-method', choices=manager.WATCH_METHODS,
+        type=str, default='poll',
+        help='How to notice executables changes: by periodically scanning '
+             'watch directory or through Linux inotify events.')
+
+    parser.add_argument(
+        '--grace-period', metavar='<[PATTERN:]SECONDS>',
+        type=_parse_grace_period, action='append', default=[],
+        help='How long processes are given to exit on SIGTERM before they '
+             'get killed, %s seconds by default. With shell PATTERN, only '
+             'applies to the executables matching it. Can be given more '
+             'than once.' % manager.GRACE_PERIOD)
+
+    parser.add_argument(
+        '--overlap-restarts', action='store_true',
+        help='Start the new process of a changed executable first, stop the '
+             'old one only once the new one has bound all the old one\'s '
+             'network endpoints. Simulator must be able to bind endpoints '
+             'the old process still holds, otherwise the old process is '
+             'stopped before the new one is started again.')
+
     parser.add_argument(
         '--reporting-method', type=lambda x: x.split(':'),
         metavar='=<%s[:args]>]' % '|'.join(ReportingManager.REPORTERS),
@@ -98,7 +126,15 @@ def main():
                 'ERROR: cant daemonize process: %s\r\n' % exc)
             return 1
 
-    manager.manage_executables(args.watch_dir)
+    try:
+        manager.manage_executables(
+            args.watch_dir, method=args.watch_method,
+            grace_periods=args.grace_period,
+            overlap=args.overlap_restarts)
+
+    except error.ControlPlaneError as exc:
+        log.error(exc)
+        return 1
 
     return 0
 
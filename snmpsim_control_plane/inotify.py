@@ -0,0 +1,246 @@
+#
+# This file is part of SNMP Simulator Control Plane software.
+#
+# Copyright (c) 2019-2020, Ilya Etingof <etingof@gmail.com>
+# License: http://snmplabs.com/snmpsim/license.html
+#
+# Linux inotify(7) bindings
+#
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+
+from snmpsim_control_plane import error
+
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_CLOSE_NOWRITE = 0x00000010
+IN_OPEN = 0x00000020
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+EVENT_HEADER = struct.Struct('iIII')
+
+READ_SIZE = 64 * 1024
+
+FS_ENCODING = sys.getfilesystemencoding() or 'utf-8'
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+
+    if _libc is None:
+        if not sys.platform.startswith('linux'):
+            raise error.ControlPlaneError(
+                'inotify is only available on Linux')
+
+        try:
+            libc = ctypes.CDLL(
+                ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+            libc.inotify_init1
+            libc.inotify_add_watch
+            libc.inotify_rm_watch
+
+        except (OSError, AttributeError) as exc:
+            raise error.ControlPlaneError(
+                'inotify is not supported by C library: %s' % exc)
+
+        _libc = libc
+
+    return _libc
+
+
+def is_available():
+    """Tell whether inotify can be used on this system."""
+    try:
+        _get_libc()
+
+    except error.ControlPlaneError:
+        return False
+
+    return True
+
+
+def _check(result, what):
+    if result < 0:
+        err = ctypes.get_errno()
+        raise error.ControlPlaneError(
+            '%s failed: %s' % (what, os.strerror(err)))
+
+    return result
+
+
+class Inotify(object):
+    """Thin wrapper around inotify file descriptor."""
+
+    def __init__(self):
+        self._libc = _get_libc()
+        self._fd = _check(
+            self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC),
+            'inotify_init1()')
+
+    def fileno(self):
+        return self._fd
+
+    def add_watch(self, path, mask):
+        if not isinstance(path, bytes):
+            path = path.encode(FS_ENCODING)
+
+        return _check(
+            self._libc.inotify_add_watch(self._fd, path, mask),
+            'inotify_add_watch(%s)' % path)
+
+    def rm_watch(self, wd):
+        # the watch might be gone already along with its object
+        self._libc.inotify_rm_watch(self._fd, wd)
+
+    def read_events(self, timeout=None):
+        """Wait for and return a list of `(wd, mask, cookie, name)` events.
+
+        Returns an empty list if nothing happens within `timeout` seconds.
+        """
+        try:
+            r, w, x = select.select([self._fd], [], [], timeout)
+
+        except select.error as exc:
+            if exc.args[0] == errno.EINTR:
+                return []
+
+            raise
+
+        if not r:
+            return []
+
+        try:
+            data = os.read(self._fd, READ_SIZE)
+
+        except OSError as exc:
+            if exc.errno in (errno.EAGAIN, errno.EINTR):
+                return []
+
+            raise
+
+        events = []
+        offset = 0
+
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+
+            offset += EVENT_HEADER.size
+
+            name = data[offset:offset + length].rstrip(b'\0')
+
+            offset += length
+
+            if not isinstance(name, str):
+                name = name.decode(FS_ENCODING, 'replace')
+
+            events.append((wd, mask, cookie, name))
+
+        return events
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class TreeWatcher(object):
+    """Watch a directory tree for file system events.
+
+    Subdirectories are watched as they appear. Each event is reported
+    as a `(path, mask)` tuple. Directory creation (`IN_ISDIR` flag set)
+    and `IN_Q_OVERFLOW` events are reported as well, so that the consumer
+    could rescan the new directory or the whole tree, as events might have
+    been missed there.
+    """
+
+    DIR_MASK = (IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE_SELF |
+                IN_ONLYDIR)
+
+    def __init__(self, top_dir, mask):
+        self._top_dir = top_dir
+        self._mask = mask
+        self._inotify = Inotify()
+        self._paths = {}
+        self._watch_tree(top_dir)
+
+    def fileno(self):
+        return self._inotify.fileno()
+
+    def _watch_tree(self, top_dir):
+        try:
+            wd = self._inotify.add_watch(top_dir, self._mask | self.DIR_MASK)
+
+        except error.ControlPlaneError:
+            if top_dir == self._top_dir:
+                raise
+
+            # subdirectory might have been removed meanwhile
+            return
+
+        self._paths[wd] = top_dir
+
+        try:
+            entries = os.listdir(top_dir)
+
+        except OSError:
+            return
+
+        for entry in entries:
+            path = os.path.join(top_dir, entry)
+            if os.path.isdir(path) and not os.path.islink(path):
+                self._watch_tree(path)
+
+    def read_events(self, timeout=None):
+        events = []
+
+        for wd, mask, cookie, name in self._inotify.read_events(timeout):
+            if mask & IN_Q_OVERFLOW:
+                events.append((self._top_dir, mask))
+                continue
+
+            top_dir = self._paths.get(wd)
+            if top_dir is None:
+                continue
+
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                continue
+
+            path = os.path.join(top_dir, name) if name else top_dir
+
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(path)
+
+            if mask & self._mask or mask & IN_ISDIR:
+                events.append((path, mask))
+
+        return events
+
+    def close(self):
+        self._inotify.close()
@@ -0,0 +1,140 @@
+#
+# This file is part of SNMP simulator Control Plane software.
+#
+# Copyright (c) 2019-2020, Ilya Etingof <etingof@gmail.com>
+# License: http://snmplabs.com/snmpsim/license.html
+#
+# SNMP simulator metrics: transport peers aggregation
+#
+import socket
+
+from snmpsim_control_plane.metrics import app
+
+# Peers not making it into the top are accounted under this address
+OTHER_PEER = 'other'
+
+
+def _parse_address(address):
+    """Return `(family, host)` of `address` or `None` if it's not an IP."""
+    for family, host in ((socket.AF_INET6, address),
+                         (socket.AF_INET, address)):
+        try:
+            socket.inet_pton(family, host)
+            return family, host
+
+        except (socket.error, ValueError):
+            pass
+
+    host, _, port = address.rpartition(':')
+    host = host.strip('[]')
+
+    if not port.isdigit():
+        return
+
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+            return family, host
+
+        except (socket.error, ValueError):
+            pass
+
+
+def _mask(family, host, bits):
+    packed = bytearray(socket.inet_pton(family, host))
+
+    for idx in range(len(packed)):
+        keep = min(8, max(0, bits - idx * 8))
+        packed[idx] &= (0xff << (8 - keep)) & 0xff
+
+    return socket.inet_ntop(family, bytes(packed))
+
+
+def collapse_peer(peer, strip_port=False, prefixes=None):
+    """Map peer address onto the one to account its activity under.
+
+    Either strip the port off peer address or replace it with the
+    network it belongs to, as given by `(IPv4, IPv6)` prefix lengths.
+    Anything not looking like an IP address is left alone.
+    """
+    if not strip_port and not prefixes:
+        return peer
+
+    parsed = _parse_address(peer)
+    if not parsed:
+        return peer
+
+    family, host = parsed
+
+    if not prefixes:
+        return host
+
+    bits = prefixes[0] if family == socket.AF_INET else prefixes[1]
+
+    return '%s/%d' % (_mask(family, host, bits), bits)
+
+
+class PeerAggregator(object):
+    """Keep the number of distinct transport peers in check.
+
+    Peers are collapsed as configured by `SNMPSIM_METRICS_PEER_STRIP_PORT`
+    and `SNMPSIM_METRICS_PEER_PREFIXES`. If `SNMPSIM_METRICS_MAX_PEERS` is
+    set, only that many peers are kept, the rest is accounted under the
+    `OTHER_PEER` address.
+
+    Which peers are kept is decided by `rank`. Unless peers are ranked,
+    first seen peers are kept.
+
+    One aggregator should be used per transport endpoint.
+    """
+
+    def __init__(self):
+        self._strip_port = app.config['SNMPSIM_METRICS_PEER_STRIP_PORT']
+        self._prefixes = app.config['SNMPSIM_METRICS_PEER_PREFIXES']
+        self._max_peers = app.config['SNMPSIM_METRICS_MAX_PEERS']
+        self._kept = set()
+        self._ranked = False
+
+    def collapse(self, peer):
+        return collapse_peer(peer, self._strip_port, self._prefixes)
+
+    def rank(self, peers):
+        """Keep the peers with the most packets in `fulljson` `peers` dict."""
+        if self._max_peers is None:
+            return
+
+        packets = {}
+
+        for peer, engines in peers.items():
+            if not isinstance(engines, dict):
+                continue
+
+            peer = self.collapse(peer)
+
+            packets[peer] = packets.get(peer, 0) + engines.get('packets', 0)
+
+        ranking = sorted(packets, key=lambda x: (-packets[x], x))
+
+        self._kept = set(ranking[:self._max_peers])
+        self._ranked = True
+
+    def __call__(self, peer):
+        peer = self.collapse(peer)
+
+        if self._max_peers is None or peer in self._kept:
+            return peer
+
+        if self._ranked or len(self._kept) >= self._max_peers:
+            return OTHER_PEER
+
+        self._kept.add(peer)
+
+        return peer
+
+
+def get_aggregator(peers):
+    """Return `PeerAggregator` ranking `fulljson` `peers` dict."""
+    aggregator = PeerAggregator()
+    aggregator.rank(peers)
+
+    return aggregator
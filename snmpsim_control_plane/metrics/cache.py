@@ -0,0 +1,119 @@
+#
+# This file is part of SNMP simulator Control Plane software.
+#
+# Copyright (c) 2019-2020, Ilya Etingof <etingof@gmail.com>
+# License: http://snmplabs.com/snmpsim/license.html
+#
+# SNMP simulator metrics: REST API response cache
+#
+import os
+import sqlite3
+import threading
+
+from snmpsim_control_plane.metrics import app
+
+TIMEOUT = 5
+
+_caches = {}
+
+
+class ResponseCache(object):
+    """REST API responses store shared by all local server processes.
+
+    Responses are kept in an SQLite file along with the metrics DB
+    generation they have been built at. Responses of past generations
+    are never served and get purged once a newer one is stored.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+        self._purged = None
+
+    def _connect(self):
+        # connections should not cross threads or forks
+        pid, conn = getattr(self._local, 'conn', (None, None))
+
+        if pid == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self._path, timeout=TIMEOUT)
+
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS response ('
+            'key TEXT PRIMARY KEY, generation TEXT NOT NULL, '
+            'status INTEGER NOT NULL, mimetype TEXT, body BLOB)')
+        conn.commit()
+
+        self._local.conn = os.getpid(), conn
+
+        return conn
+
+    def get(self, key, generation):
+        """Return `(status, mimetype, body)` cached at `generation`.
+
+        Returns `None` on cache miss.
+        """
+        conn = self._connect()
+
+        return conn.execute(
+            'SELECT status, mimetype, body FROM response '
+            'WHERE key = ? AND generation = ?', (key, generation)).fetchone()
+
+    def put(self, key, generation, status, mimetype, body):
+        """Store response built at `generation`."""
+        conn = self._connect()
+
+        with conn:
+            if self._purged != generation:
+                conn.execute(
+                    'DELETE FROM response WHERE generation != ?',
+                    (generation,))
+                self._purged = generation
+
+            conn.execute(
+                'INSERT OR REPLACE INTO response '
+                '(key, generation, status, mimetype, body) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, generation, status, mimetype, sqlite3.Binary(body)))
+
+
+def get_cache():
+    """Return response cache or `None` if it's not configured."""
+    path = app.config.get('SNMPSIM_METRICS_RESPONSE_CACHE')
+    if not path:
+        return
+
+    cache = _caches.get(path)
+
+    if cache is None:
+        cache = _caches[path] = ResponseCache(path)
+
+    return cache
+
+
+def get_response(key, generation):
+    """Look up cached response, see `ResponseCache.get`."""
+    cache = get_cache()
+    if not cache:
+        return
+
+    try:
+        return cache.get(key, generation)
+
+    except sqlite3.Error as exc:
+        app.logger.error('Response cache lookup failed: %s' % exc)
+
+
+def put_response(key, generation, status, mimetype, body):
+    """Store response in cache, see `ResponseCache.put`."""
+    cache = get_cache()
+    if not cache:
+        return
+
+    try:
+        cache.put(key, generation, status, mimetype, body)
+
+    except sqlite3.Error as exc:
+        app.logger.error('Response cache update failed: %s' % exc)
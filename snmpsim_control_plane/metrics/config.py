@@ -18,3 +18,34 @@ class DefaultConfig(object):
     SNMPSIM_METRICS_LISTEN_PORT = 5001
     SNMPSIM_METRICS_SSL_CERT = None
     SNMPSIM_METRICS_SSL_KEY = None
+    SNMPSIM_METRICS_BULK_IMPORT = True
+    SNMPSIM_METRICS_DIMENSION_CACHE_SIZE = 50000
+    SNMPSIM_METRICS_COALESCE_WINDOW = 0
+    SNMPSIM_METRICS_COALESCE_MAX_DOCUMENTS = 100
+    SNMPSIM_METRICS_STREAMING_THRESHOLD = 8 * 1024 * 1024
+    SNMPSIM_METRICS_STREAMING_BATCH_SIZE = 10000
+    # (resolution, retention) pairs in seconds
+    SNMPSIM_METRICS_SERIES_RESOLUTIONS = [
+        (60, 2 * 86400), (3600, 31 * 86400), (86400, 366 * 86400)
+    ]
+    SNMPSIM_METRICS_ROLLUP_PERIOD = 300
+    # seconds between activity rates samples
+    SNMPSIM_METRICS_RATE_PERIOD = 60
+    SNMPSIM_METRICS_MAX_PAGE_SIZE = 1000
+    # console pages kept per simulator process
+    SNMPSIM_METRICS_CONSOLE_RING_SIZE = 1000
+    # seconds to keep metrics not being updated, None to keep forever
+    SNMPSIM_METRICS_TRANSPORT_RETENTION = 7 * 86400
+    SNMPSIM_METRICS_PROCESS_RETENTION = 7 * 86400
+    SNMPSIM_METRICS_CONSOLE_RETENTION = 86400
+    SNMPSIM_METRICS_RETENTION_PERIOD = 3600
+    SNMPSIM_METRICS_RETENTION_BATCH_SIZE = 500
+    # transport peers aggregation
+    SNMPSIM_METRICS_PEER_STRIP_PORT = False
+    # (IPv4, IPv6) network prefix lengths e.g. (24, 64)
+    SNMPSIM_METRICS_PEER_PREFIXES = None
+    # per transport endpoint in a report
+    SNMPSIM_METRICS_MAX_PEERS = None
+    # shared by metrics importers and REST API servers
+    SNMPSIM_METRICS_GENERATION_FILE = None
+    SNMPSIM_METRICS_RESPONSE_CACHE = None
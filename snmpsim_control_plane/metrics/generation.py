@@ -0,0 +1,135 @@
+#
+# This file is part of SNMP simulator Control Plane software.
+#
+# Copyright (c) 2019-2020, Ilya Etingof <etingof@gmail.com>
+# License: http://snmplabs.com/snmpsim/license.html
+#
+# SNMP simulator metrics: metrics DB import generation counter
+#
+import fcntl
+import mmap
+import os
+import random
+import struct
+import time
+
+from snmpsim_control_plane import error
+from snmpsim_control_plane import log
+from snmpsim_control_plane.metrics import app
+
+# file creation nonce, generation number
+GENERATION = struct.Struct('<QQ')
+
+WAIT_PERIOD = 0.1
+
+_generations = {}
+
+
+class ImportGeneration(object):
+    """Metrics DB change counter shared by all local processes.
+
+    The counter lives in a small memory-mapped file. Metrics importers
+    bump it whenever they commit into metrics DB, REST API servers
+    compare it with the one their cached responses were built at.
+
+    The file also holds a random nonce set on its creation, so that
+    counters do not repeat should the file get re-created.
+    """
+
+    def __init__(self, path):
+        self._path = path
+
+        try:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+            try:
+                if os.fstat(self._fd).st_size < GENERATION.size:
+                    os.write(self._fd, GENERATION.pack(
+                        random.getrandbits(64), 0))
+
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+            self._mmap = mmap.mmap(self._fd, GENERATION.size)
+
+        except (OSError, IOError, mmap.error) as exc:
+            raise error.ControlPlaneError(
+                'Can not open generation file %s: %s' % (path, exc))
+
+    def get(self):
+        """Return current `(nonce, generation)` tuple."""
+        current = GENERATION.unpack_from(self._mmap)
+
+        # guard against reading half-updated counter
+        while True:
+            previous, current = current, GENERATION.unpack_from(self._mmap)
+            if current == previous:
+                return current
+
+    def bump(self):
+        """Increment generation number."""
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+        try:
+            nonce, number = GENERATION.unpack_from(self._mmap)
+            GENERATION.pack_into(self._mmap, 0, nonce, number + 1)
+
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+def _get_generation():
+    path = app.config.get('SNMPSIM_METRICS_GENERATION_FILE')
+    if not path:
+        return
+
+    generation = _generations.get(path)
+
+    if generation is None:
+        generation = _generations[path] = ImportGeneration(path)
+
+    return generation
+
+
+def get_generation():
+    """Return current metrics DB generation as `(nonce, number)` tuple.
+
+    Returns `None` if generation tracking is not configured.
+    """
+    generation = _get_generation()
+    if generation:
+        return generation.get()
+
+
+def bump():
+    """Note that metrics DB contents have changed.
+
+    Does nothing unless generation tracking is configured.
+    """
+    try:
+        generation = _get_generation()
+        if generation:
+            generation.bump()
+
+    except Exception as exc:
+        log.error('Failed to bump metrics DB generation: %s' % exc)
+
+
+def wait(current, timeout):
+    """Wait up to `timeout` seconds for generation to move on from `current`.
+
+    Returns `True` if generation has changed meanwhile.
+    """
+    deadline = time.time() + timeout
+
+    while True:
+        if get_generation() != current:
+            return True
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+
+        time.sleep(min(WAIT_PERIOD, remaining))
@@ -0,0 +1,612 @@
+#
+# This file is part of SNMP simulator Control Plane software.
+#
+# Copyright (c) 2019-2020, Ilya Etingof <etingof@gmail.com>
+# License: http://snmplabs.com/snmpsim/license.html
+#
+# SNMP simulator metrics: set-based snmpsim metrics importer
+#
+import datetime
+import time
+
+from sqlalchemy import bindparam
+from sqlalchemy import func
+from sqlalchemy import text
+
+from snmpsim_control_plane.metrics import aggregation
+from snmpsim_control_plane.metrics import app
+from snmpsim_control_plane.metrics import config
+from snmpsim_control_plane.metrics import db
+from snmpsim_control_plane.metrics import models
+from snmpsim_control_plane.metrics import rollups
+from snmpsim_control_plane.metrics import summaries
+from snmpsim_control_plane.metrics.utils import ID_ALLOCATOR
+from snmpsim_control_plane.metrics.utils import LruCache
+
+# Keep the number of bound parameters per statement below the lowest
+# limit among supported DB engines (SQLite's default is 999)
+MAX_SQL_PARAMS = 900
+
+# Oldest SQLite release supporting `INSERT ... ON CONFLICT DO UPDATE`
+MIN_SQLITE_VERSION = (3, 24, 0)
+
+TRANSPORT_COLUMNS = (
+    'transport_protocol', 'endpoint', 'peer'
+)
+
+TERM_COLUMNS = (
+    'kind', 'value'
+)
+
+AGENT_COLUMNS = (
+    'transport_id', 'engine_id', 'security_model', 'security_level',
+    'context_engine_id', 'context_name_id'
+)
+
+RECORDING_COLUMNS = (
+    'agent_id', 'path_id'
+)
+
+PDU_COLUMNS = (
+    'recording_id', 'name_id'
+)
+
+# Messages key elements interned as `Term` values
+MESSAGE_TERMS = (
+    (3, models.ENGINE_TERM),
+    (6, models.CONTEXT_ENGINE_TERM),
+    (7, models.CONTEXT_NAME_TERM),
+    (8, models.RECORDING_TERM),
+    (9, models.PDU_TYPE_TERM),
+)
+
+PACKET_COUNTERS = (
+    'total', 'parse_failures', 'auth_failures', 'context_failures'
+)
+
+# Maps `(table, natural key)` onto row ID for dimension rows known to
+# exist in the DB. Must be cleared whenever DB transaction is rolled back.
+DIMENSION_CACHE = LruCache(
+    config.DefaultConfig.SNMPSIM_METRICS_DIMENSION_CACHE_SIZE)
+
+
+class MetricsBatch(object):
+    """Flattened SNMP activity counters.
+
+    Counters are keyed by the natural keys of the metrics DB rows they
+    end up in. Counters sharing the same key are summed up as they
+    are added, so that any number of `fulljson` documents can be folded
+    into one batch and written into the DB at once.
+
+    Keys are tuples built like this:
+
+    * packets: `(transport_protocol, endpoint, peer)`
+    * messages: packets key + `(engine, security_model, security_level,
+      context_engine, context_name, recording, pdu_type)`
+    * variations: messages key + `(variation_module,)`
+
+    Unless `timestamp` is `None`, packets and messages counters are also
+    accumulated into series by report time. Series keys are the above keys
+    prefixed with the `timestamp` of the report.
+    """
+
+    def __init__(self):
+        self.packets = {}
+        self.messages = {}
+        self.variations = {}
+        self.packet_series = {}
+        self.message_series = {}
+        self.timestamp = None
+        self.documents = 0
+
+    @staticmethod
+    def _add(rows, key, counters):
+        row = rows.get(key)
+        if row is None:
+            rows[key] = list(counters)
+
+        else:
+            for idx, counter in enumerate(counters):
+                row[idx] += counter
+
+    def add_packets(self, key, counters):
+        self._add(self.packets, key, counters)
+
+        if self.timestamp is not None:
+            self._add(self.packet_series, (self.timestamp,) + key, counters)
+
+    def add_messages(self, key, counters):
+        self._add(self.messages, key, counters)
+
+        if self.timestamp is not None:
+            self._add(self.message_series, (self.timestamp,) + key, counters)
+
+    def add_variation(self, key, counters):
+        self._add(self.variations, key, counters)
+
+    def update(self, other):
+        """Fold another batch into this one."""
+        for key, counters in other.packets.items():
+            self._add(self.packets, key, counters)
+
+        for key, counters in other.messages.items():
+            self._add(self.messages, key, counters)
+
+        for key, counters in other.variations.items():
+            self._add(self.variations, key, counters)
+
+        for key, counters in other.packet_series.items():
+            self._add(self.packet_series, key, counters)
+
+        for key, counters in other.message_series.items():
+            self._add(self.message_series, key, counters)
+
+        self.documents += other.documents
+
+    def __len__(self):
+        return (len(self.packets) + len(self.messages) +
+                len(self.variations) + len(self.packet_series) +
+                len(self.message_series))
+
+
+def flatten_metrics(fulljson, batch=None):
+    """Flatten `fulljson` data structure into a batch of counters.
+
+    Transport peers are aggregated as configured on the way.
+
+    See `snmpagent.import_metrics` for the input data structure layout.
+    """
+    if batch is None:
+        batch = MetricsBatch()
+
+    batch.timestamp = rollups.get_timestamp(fulljson)
+
+    for tr_proto, tr_endpoints in fulljson.items():
+
+        if not isinstance(tr_endpoints, dict):
+            continue
+
+        for tr_endpoint, peers in tr_endpoints.items():
+
+            if not isinstance(peers, dict):
+                continue
+
+            aggregate_peer = aggregation.get_aggregator(peers)
+
+            for peer_address, engines in peers.items():
+
+                if not isinstance(engines, dict):
+                    continue
+
+                flatten_peer(
+                    batch, (tr_proto, tr_endpoint,
+                            aggregate_peer(peer_address)), engines)
+
+    batch.documents += 1
+
+    return batch
+
+
+def flatten_peer(batch, tr_key, engines):
+    """Flatten counters of a single transport peer into a batch.
+
+    The `tr_key` is a `(transport_protocol, endpoint, peer)` tuple.
+    """
+    batch.add_packets(
+        tr_key, [engines.get('packets', 0),
+                 engines.get('parse_failures', 0),
+                 engines.get('auth_failures', 0),
+                 engines.get('context_failures', 0)])
+
+    for engine_id, security_models in engines.items():
+        if not isinstance(security_models, dict):
+            continue
+
+        for security_model, security_levels in security_models.items():
+            if not isinstance(security_levels, dict):
+                continue
+
+            for security_level, context_engines in security_levels.items():
+                if not isinstance(context_engines, dict):
+                    continue
+
+                for ctx_engine_id, ctx_names in context_engines.items():
+                    if not isinstance(ctx_names, dict):
+                        continue
+
+                    for context_name, pdus in ctx_names.items():
+                        if not isinstance(pdus, dict):
+                            continue
+
+                        agent_key = tr_key + (
+                            engine_id, int(security_model),
+                            int(security_level), ctx_engine_id,
+                            context_name)
+
+                        _flatten_pdus(batch, agent_key, pdus)
+
+
+def _flatten_pdus(batch, agent_key, pdus):
+    for pdu_type, recordings in pdus.items():
+        if not isinstance(recordings, dict):
+            continue
+
+        for recording, counters in recordings.items():
+            msg_key = agent_key + (recording, pdu_type)
+
+            batch.add_messages(
+                msg_key, [counters.get('pdus', 0),
+                          counters.get('varbinds', 0),
+                          counters.get('failures', 0)])
+
+            variations = counters.get('variations', {})
+
+            for name, vartn_counters in variations.items():
+                batch.add_variation(
+                    msg_key + (name,), [vartn_counters.get('calls', 0),
+                                        vartn_counters.get('failures', 0)])
+
+
+def is_supported():
+    """Tell whether current DB engine can run bulk upserts."""
+    dialect = db.engine.dialect
+
+    if dialect.name == 'sqlite':
+        return dialect.dbapi.sqlite_version_info >= MIN_SQLITE_VERSION
+
+    return dialect.name == 'postgresql'
+
+
+def is_enabled():
+    """Tell whether bulk import should be used."""
+    return app.config['SNMPSIM_METRICS_BULK_IMPORT'] and is_supported()
+
+
+def _chunks(items, size):
+    items = list(items)
+
+    for idx in range(0, len(items), size):
+        yield items[idx:idx + size]
+
+
+def _quote(name):
+    return db.engine.dialect.identifier_preparer.quote(name)
+
+
+def _insert_statement(model, columns, conflict_columns, sum_columns=()):
+    """Build `INSERT ... ON CONFLICT` statement for `model`.
+
+    On natural key conflict, either sum up `sum_columns` with the
+    existing values or leave the existing row alone.
+    """
+    table = _quote(model.__table__.name)
+
+    statement = 'INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s) ' % (
+        table, ', '.join(_quote(c) for c in columns),
+        ', '.join(':%s' % c for c in columns),
+        ', '.join(_quote(c) for c in conflict_columns))
+
+    if sum_columns:
+        statement += 'DO UPDATE SET %s' % ', '.join(
+            '%s = coalesce(%s.%s, 0) + excluded.%s' % (
+                _quote(c), table, _quote(c), _quote(c))
+            for c in sum_columns)
+
+    else:
+        statement += 'DO NOTHING'
+
+    return text(statement)
+
+
+def _select_ids(model, columns, keys):
+    table = _quote(model.__table__.name)
+    quoted_columns = ', '.join(_quote(c) for c in columns)
+
+    ids = {}
+
+    for chunk in _chunks(keys, MAX_SQL_PARAMS // len(columns)):
+        params = {}
+        values = []
+
+        for key in chunk:
+            names = []
+
+            for value in key:
+                name = 'p%d' % len(params)
+                params[name] = value
+                names.append(':' + name)
+
+            values.append('(%s)' % ', '.join(names))
+
+        # Compiling SQLAlchemy expressions of this size turns out to be
+        # way more expensive than running the query itself
+        query = text(
+            'SELECT id, %s FROM %s WHERE (%s) IN (VALUES %s)' % (
+                quoted_columns, table, quoted_columns, ', '.join(values)))
+
+        for row in db.session.execute(query, params):
+            ids[tuple(row)[1:]] = row[0]
+
+    return ids
+
+
+def _resolve_ids(model, columns, keys):
+    """Map natural keys onto row IDs creating missing rows on the way."""
+    name = model.__table__.name
+
+    ids = {}
+    unknown = []
+
+    for key in keys:
+        row_id = DIMENSION_CACHE.get((name, key))
+        if row_id is None:
+            unknown.append(key)
+
+        else:
+            ids[key] = row_id
+
+    if not unknown:
+        return ids
+
+    ids.update(_select_ids(model, columns, unknown))
+
+    missing = [key for key in unknown if key not in ids]
+
+    if missing:
+        rows = []
+
+        for key, row_id in zip(
+                missing, ID_ALLOCATOR.allocate(model, len(missing))):
+            row = dict(zip(columns, key))
+            row['id'] = row_id
+            rows.append(row)
+
+        statement = _insert_statement(model, ('id',) + columns, columns)
+
+        db.session.execute(statement, rows)
+
+        # someone else might have created some of these rows meanwhile
+        ids.update(_select_ids(model, columns, missing))
+
+    for key in unknown:
+        DIMENSION_CACHE[(name, key)] = ids[key]
+
+    return ids
+
+
+def _unique(keys):
+    seen = set()
+
+    for key in keys:
+        if key not in seen:
+            seen.add(key)
+            yield key
+
+
+def _fold_series(series, make_key):
+    """Sum up series counters falling into the same series interval."""
+    now = time.time()
+
+    rows = {}
+    dirty = {}
+
+    for key, counters in series.items():
+        resolution, timestamp = rollups.get_interval(key[0], now)
+
+        row_key = (resolution, timestamp, make_key(key[1:]))
+
+        row = rows.get(row_key)
+        if row is None:
+            rows[row_key] = list(counters)
+
+        else:
+            for idx, counter in enumerate(counters):
+                row[idx] += counter
+
+        dirty[resolution] = min(dirty.get(resolution, timestamp), timestamp)
+
+    return rows, dirty
+
+
+def _import_series(batch, transport_ids, pdu_ids, pdu_keys):
+    columns = ('resolution', 'timestamp')
+
+    dirty = {}
+
+    for series, model, id_column, counter_columns, make_key in (
+            (batch.packet_series, models.PacketSeries, 'transport_id',
+             rollups.PACKET_SERIES_COUNTERS, transport_ids.__getitem__),
+            (batch.message_series, models.MessageSeries, 'pdu_id',
+             rollups.MESSAGE_SERIES_COUNTERS,
+             lambda key: pdu_ids[pdu_keys[key]])):
+
+        if not series:
+            continue
+
+        rows, series_dirty = _fold_series(series, make_key)
+
+        rows = [dict(zip(counter_columns, counters),
+                     **dict(zip(columns + (id_column,), key)))
+                for key, counters in rows.items()]
+
+        statement = _insert_statement(
+            model, columns + (id_column,) + counter_columns,
+            columns + (id_column,), counter_columns)
+
+        db.session.execute(statement, rows)
+
+        for resolution, since in series_dirty.items():
+            dirty[resolution] = min(dirty.get(resolution, since), since)
+
+    for resolution, since in dirty.items():
+        rollups.mark_dirty(since, resolution)
+
+
+def _touch_transports(transport_ids):
+    """Note that transports have just been updated.
+
+    Returns `False` if some of the transports do not exist.
+    """
+    table = models.Transport.__table__
+
+    now = datetime.datetime.utcnow()
+
+    transport_ids = list(transport_ids)
+
+    touched = 0
+
+    for chunk in _chunks(transport_ids, MAX_SQL_PARAMS):
+        result = db.session.execute(
+            table.update()
+            .where(table.c.id.in_(chunk))
+            .values(last_update=now))
+
+        touched += result.rowcount
+
+    return touched == len(transport_ids)
+
+
+def _import_summaries(batch):
+    packets, messages, variations = summaries.summarize(batch)
+
+    for model, columns, counter_columns, rows in (
+            (models.PacketSummary, ('dimension', 'value'),
+             summaries.PACKET_SUMMARY_COUNTERS, packets),
+            (models.MessageSummary, ('dimension', 'value'),
+             summaries.MESSAGE_SUMMARY_COUNTERS, messages),
+            (models.VariationSummary, ('dimension', 'value', 'name'),
+             summaries.VARIATION_SUMMARY_COUNTERS, variations)):
+
+        if not rows:
+            continue
+
+        rows = [dict(zip(columns + counter_columns, key + tuple(counters)))
+                for key, counters in rows.items()]
+
+        statement = _insert_statement(
+            model, columns + counter_columns, columns, counter_columns)
+
+        db.session.execute(statement, rows)
+
+
+def import_batch(batch, commit=True):
+    """Update metrics DB from a batch of flattened counters.
+
+    All counters are applied by a handful of set-based statements
+    within a single transaction. Unless `commit` is set, the transaction
+    is left open for the caller to commit.
+    """
+    if not batch:
+        return
+
+    DIMENSION_CACHE.max_size = app.config[
+        'SNMPSIM_METRICS_DIMENSION_CACHE_SIZE']
+
+    # Resolve dimension rows top-down
+
+    transport_keys = list(_unique(
+        list(batch.packets) + [key[:3] for key in batch.messages]))
+
+    transport_ids = _resolve_ids(
+        models.Transport, TRANSPORT_COLUMNS, transport_keys)
+
+    # cached rows might have been purged as stale meanwhile
+    if not _touch_transports(transport_ids.values()):
+        DIMENSION_CACHE.clear()
+
+        transport_ids = _resolve_ids(
+            models.Transport, TRANSPORT_COLUMNS, transport_keys)
+
+        _touch_transports(transport_ids.values())
+
+    term_keys = [(kind, key[idx])
+                 for key in batch.messages for idx, kind in MESSAGE_TERMS]
+    term_keys.extend(
+        (models.VARIATION_TERM, key[10]) for key in batch.variations)
+
+    term_ids = _resolve_ids(models.Term, TERM_COLUMNS, _unique(term_keys))
+
+    agent_keys = {
+        key: (transport_ids[key[:3]],
+              term_ids[(models.ENGINE_TERM, key[3])], key[4], key[5],
+              term_ids[(models.CONTEXT_ENGINE_TERM, key[6])],
+              term_ids[(models.CONTEXT_NAME_TERM, key[7])])
+        for key in batch.messages}
+
+    agent_ids = _resolve_ids(
+        models.Agent, AGENT_COLUMNS, _unique(agent_keys.values()))
+
+    recording_keys = {
+        key: (agent_ids[agent_keys[key]],
+              term_ids[(models.RECORDING_TERM, key[8])])
+        for key in batch.messages}
+
+    recording_ids = _resolve_ids(
+        models.Recording, RECORDING_COLUMNS, _unique(recording_keys.values()))
+
+    pdu_keys = {
+        key: (recording_ids[recording_keys[key]],
+              term_ids[(models.PDU_TYPE_TERM, key[9])])
+        for key in batch.messages}
+
+    pdu_ids = _resolve_ids(
+        models.Pdu, PDU_COLUMNS, _unique(pdu_keys.values()))
+
+    # Add up counters
+
+    if batch.packets:
+        rows = [dict(zip(PACKET_COUNTERS, counters),
+                     transport_id=transport_ids[key])
+                for key, counters in batch.packets.items()]
+
+        statement = _insert_statement(
+            models.Packet, ('transport_id',) + PACKET_COUNTERS,
+            ('transport_id',), PACKET_COUNTERS)
+
+        db.session.execute(statement, rows)
+
+    if batch.messages:
+        rows = [{'pdu_ref': pdu_ids[pdu_keys[key]], 'pdus': counters[0]}
+                for key, counters in batch.messages.items()]
+
+        table = models.Pdu.__table__
+
+        statement = (
+            table.update()
+            .where(table.c.id == bindparam('pdu_ref'))
+            .values(total=func.coalesce(table.c.total, 0) +
+                    bindparam('pdus')))
+
+        db.session.execute(statement, rows)
+
+        rows = [{'pdu_id': pdu_ids[pdu_keys[key]],
+                 'total': counters[1],
+                 'failures': counters[2]}
+                for key, counters in batch.messages.items()]
+
+        statement = _insert_statement(
+            models.VarBind, ('pdu_id', 'total', 'failures'),
+            ('pdu_id',), ('total', 'failures'))
+
+        db.session.execute(statement, rows)
+
+    if batch.variations:
+        rows = [{'pdu_id': pdu_ids[pdu_keys[key[:10]]],
+                 'name_id': term_ids[(models.VARIATION_TERM, key[10])],
+                 'total': counters[0],
+                 'failures': counters[1]}
+                for key, counters in batch.variations.items()]
+
+        statement = _insert_statement(
+            models.Variation, ('pdu_id', 'name_id', 'total', 'failures'),
+            ('pdu_id', 'name_id'), ('total', 'failures'))
+
+        db.session.execute(statement, rows)
+
+    _import_summaries(batch)
+
+    if batch.packet_series or batch.message_series:
+        _import_series(batch, transport_ids, pdu_ids, pdu_keys)
+
+    if commit:
+        db.session.commit()
@@ -7,14 +7,12 @@
 # SNMP simulator metrics: supervisor metrics importer
 #
 import datetime
-import time
 
+from snmpsim_control_plane.metrics import app
 from snmpsim_control_plane.metrics import db
 from snmpsim_control_plane.metrics import models
 from snmpsim_control_plane.metrics.utils import autoincrement
 
-MAX_CONSOLE_PAGE_AGE = 86400  # one day
-
 
 def import_metrics(jsondoc):
     """Update metrics DB from `dict` data structure.
@@ -43,6 +41,7 @@ def import_metrics(jsondoc):
                 'files': 0,
                 'exits': 0,
                 'changes': 0,
+                'swap_latency': 0,
                 'endpoints': {
                     'udpv4': [
                         '127.0.0.1:161'
@@ -61,7 +60,7 @@ def import_metrics(jsondoc):
         ]
     }
     """
-    old_times = int(time.time() - MAX_CONSOLE_PAGE_AGE)
+    ring_size = app.config['SNMPSIM_METRICS_CONSOLE_RING_SIZE']
 
     timestamp = datetime.datetime.utcfromtimestamp(
         jsondoc['started'])
@@ -76,6 +75,9 @@ def import_metrics(jsondoc):
 
     autoincrement(supervisor_model, models.Supervisor)
 
+    supervisor_model.last_update = datetime.datetime.utcfromtimestamp(
+        jsondoc['last_update'])
+
     for executable in jsondoc['executables']:
 
         process_model = models.Process(
@@ -97,6 +99,10 @@ def import_metrics(jsondoc):
 
         process_model.files = executable['files']
 
+        # not reported by older supervisors
+        if 'swap_latency' in executable:
+            process_model.swap_latency = executable['swap_latency']
+
         process_model.exits = process_model.exits or 0
         process_model.exits += executable['exits']
 
@@ -106,6 +112,13 @@ def import_metrics(jsondoc):
         process_model.update_interval = (
             jsondoc['last_update'] - jsondoc['first_update'])
 
+        # reported counters are changes over update interval
+        if process_model.update_interval > 0:
+            process_model.cpu_rate = (
+                float(executable['cpu']) / process_model.update_interval)
+            process_model.exits_rate = (
+                executable['exits'] * 3600.0 / process_model.update_interval)
+
         timestamp = datetime.datetime.utcfromtimestamp(
             jsondoc['last_update'])
 
@@ -149,28 +162,26 @@ def import_metrics(jsondoc):
 
             query.delete()
 
-        query = (
-            db.session
-            .query(models.ConsolePage)
-            .filter(models.ConsolePage.process_id == process_model.id)
-            .filter(models.ConsolePage.timestamp < old_times)
-        )
+        process_model.console_position = process_model.console_position or 0
 
-        query.delete()
-
-        for console_page in executable['console']:
+        # older pages would be overwritten right away
+        for console_page in executable['console'][-ring_size:]:
 
             timestamp = datetime.datetime.utcfromtimestamp(
                 console_page['timestamp'])
 
             console_page_model = models.ConsolePage(
+                slot=process_model.console_position % ring_size,
                 timestamp=timestamp,
                 text=console_page['text'],
                 process_id=process_model.id
             )
 
+            # overwritten page is a new page
             autoincrement(console_page_model, models.ConsolePage)
 
-            db.session.add(console_page_model)
+            db.session.merge(console_page_model)
+
+            process_model.console_position += 1
 
         db.session.commit()
@@ -6,11 +6,25 @@
 #
 # SNMP simulator metrics: snmpsim metrics importer
 #
+import datetime
+
+from snmpsim_control_plane.metrics import aggregation
 from snmpsim_control_plane.metrics import db
 from snmpsim_control_plane.metrics import models
+from snmpsim_control_plane.metrics import summaries
+from snmpsim_control_plane.metrics.importers import bulk
 from snmpsim_control_plane.metrics.utils import autoincrement
 
 
+def _intern(kind, value):
+    """Return ID of the `Term` holding `value` creating one if needed."""
+    term_mdl = db.session.merge(models.Term(kind=kind, value=value))
+
+    autoincrement(term_mdl, models.Term)
+
+    return term_mdl.id
+
+
 def import_metrics(fulljson):
     """Update metrics DB from `dict` data structure.
 
@@ -61,7 +75,24 @@ def import_metrics(fulljson):
             }
         }
     }
+
+    Whenever DB engine supports that, the whole document is flattened
+    and applied by a handful of bulk upserts. Otherwise the DB is updated
+    node by node.
+
+    Either way, activity summaries served by REST API are updated
+    along the way.
     """
+    if bulk.is_enabled():
+        bulk.import_batch(bulk.flatten_metrics(fulljson))
+
+    else:
+        _import_metrics_by_node(fulljson)
+
+        summaries.import_summaries_by_node(bulk.flatten_metrics(fulljson))
+
+
+def _import_metrics_by_node(fulljson):
     for tr_proto, tr_endpoints in fulljson.items():
 
         if not isinstance(tr_endpoints, dict):
@@ -72,6 +103,9 @@ def import_metrics(fulljson):
             if not isinstance(peers, dict):
                 continue
 
+            # peers aggregated together are summed up by `merge`
+            aggregate_peer = aggregation.get_aggregator(peers)
+
             for peer_adddress, engines in peers.items():
 
                 if not isinstance(engines, dict):
@@ -80,13 +114,15 @@ def import_metrics(fulljson):
                 tr_mdl = models.Transport(
                     transport_protocol=tr_proto,
                     endpoint=tr_endpoint,
-                    peer=peer_adddress,
+                    peer=aggregate_peer(peer_adddress),
                 )
 
                 tr_mdl = db.session.merge(tr_mdl)
 
                 autoincrement(tr_mdl, models.Transport)
 
+                tr_mdl.last_update = datetime.datetime.utcnow()
+
                 packet_mdl = models.Packet(
                     transport_id=tr_mdl.id)
 
@@ -137,11 +173,17 @@ def import_metrics(fulljson):
                                                 recordings.items()):
                                             agent_mdl = models.Agent(
                                                 transport_id=tr_mdl.id,
-                                                engine=engine_id,
+                                                engine_id=_intern(
+                                                    models.ENGINE_TERM,
+                                                    engine_id),
                                                 security_model=security_model,
                                                 security_level=security_level,
-                                                context_engine=ctx_engine_id,
-                                                context_name=context_name,
+                                                context_engine_id=_intern(
+                                                    models.CONTEXT_ENGINE_TERM,
+                                                    ctx_engine_id),
+                                                context_name_id=_intern(
+                                                    models.CONTEXT_NAME_TERM,
+                                                    context_name),
                                             )
 
                                             agent_mdl = db.session.merge(
@@ -152,7 +194,9 @@ def import_metrics(fulljson):
 
                                             recording_mdl = models.Recording(
                                                 agent_id=agent_mdl.id,
-                                                path=recording)
+                                                path_id=_intern(
+                                                    models.RECORDING_TERM,
+                                                    recording))
 
                                             recording_mdl = db.session.merge(
                                                 recording_mdl)
@@ -163,7 +207,9 @@ def import_metrics(fulljson):
 
                                             pdu_mdl = models.Pdu(
                                                 recording_id=recording_mdl.id,
-                                                name=pdu_type)
+                                                name_id=_intern(
+                                                    models.PDU_TYPE_TERM,
+                                                    pdu_type))
 
                                             pdu_mdl = db.session.merge(
                                                 pdu_mdl)
@@ -199,7 +245,9 @@ def import_metrics(fulljson):
 
                                                 vartn_mdl = models.Variation(
                                                     pdu_id=pdu_mdl.id,
-                                                    name=name)
+                                                    name_id=_intern(
+                                                        models.VARIATION_TERM,
+                                                        name))
 
                                                 vartn_mdl = (
                                                     db.session.merge(
@@ -0,0 +1,219 @@
+#
+# This file is part of SNMP simulator Control Plane software.
+#
+# Copyright (c) 2019-2020, Ilya Etingof <etingof@gmail.com>
+# License: http://snmplabs.com/snmpsim/license.html
+#
+# SNMP simulator metrics: streaming snmpsim metrics importer
+#
+import json
+
+from snmpsim_control_plane import log
+from snmpsim_control_plane.metrics import aggregation
+from snmpsim_control_plane.metrics import app
+from snmpsim_control_plane.metrics import db
+from snmpsim_control_plane.metrics import rollups
+from snmpsim_control_plane.metrics.importers import bulk
+
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = ' \t\n\r'
+
+DELIMITERS = WHITESPACE + ',:]}'
+
+
+class NotStreamable(Exception):
+    """Document is not a `fulljson` one."""
+
+
+class JsonStream(object):
+    """Incremental JSON reader.
+
+    Walks JSON objects key by key, reading the underlying file in chunks.
+    Values can either be decoded as a whole by `read_value` or, if they
+    are objects, walked further by `iter_object`.
+    """
+
+    def __init__(self, fl, chunk_size=CHUNK_SIZE):
+        self._fl = fl
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size=None):
+        if self._eof:
+            return False
+
+        # drop what has been consumed already
+        if self._pos >= self._chunk_size:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+
+        data = self._fl.read(size or self._chunk_size)
+        if not data:
+            self._eof = True
+            return False
+
+        self._buf += data
+
+        return True
+
+    def peek(self):
+        """Return next non-whitespace character without consuming it."""
+        while True:
+            buf = self._buf
+            pos = self._pos
+
+            while pos < len(buf) and buf[pos] in WHITESPACE:
+                pos += 1
+
+            self._pos = pos
+
+            if pos < len(buf):
+                return buf[pos]
+
+            if not self._fill():
+                raise ValueError('Unexpected end of JSON document')
+
+    def _expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise ValueError(
+                'Expecting one of "%s" but got "%s"' % (chars, char))
+
+        self._pos += 1
+
+        return char
+
+    def read_value(self):
+        """Decode next JSON value as a whole."""
+        self.peek()
+
+        size = self._chunk_size
+
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+
+            except ValueError:
+                if not self._fill(size):
+                    raise
+
+                # large values should not be decoded over and over again
+                size = max(size, len(self._buf) - self._pos)
+                continue
+
+            # numbers could be cut off at buffer end
+            if (end < len(self._buf) and self._buf[end] in DELIMITERS or
+                    not self._fill(size)):
+                self._pos = end
+                return value
+
+    def iter_object(self):
+        """Iterate over the keys of next JSON object.
+
+        The value following each key must be consumed by the caller
+        before advancing to the next key.
+        """
+        self._expect('{')
+
+        if self.peek() == '}':
+            self._pos += 1
+            return
+
+        while True:
+            if self.peek() != '"':
+                raise ValueError('Expecting object key')
+
+            key = self.read_value()
+
+            self._expect(':')
+
+            yield key
+
+            if self._expect(',}') == '}':
+                return
+
+    def close(self):
+        """Make sure there is nothing but whitespace left."""
+        try:
+            char = self.peek()
+
+        except ValueError:
+            return
+
+        raise ValueError('Extra data "%s" after JSON document' % char)
+
+
+def import_metrics(fl):
+    """Stream `fulljson` metrics document from file into metrics DB.
+
+    Only the subtree of a single peer is kept in memory at a time. Its
+    counters are flattened into a batch, which gets written into the DB
+    once it grows to `SNMPSIM_METRICS_STREAMING_BATCH_SIZE` rows. All
+    batches are written within the same DB transaction, it is committed
+    once the whole document has been read.
+
+    Raises `NotStreamable` if the document turns out not to be of
+    `fulljson` format. DB transaction must be rolled back then.
+
+    See `snmpagent.import_metrics` for the input data structure layout.
+    """
+    max_rows = app.config['SNMPSIM_METRICS_STREAMING_BATCH_SIZE']
+
+    stream = JsonStream(fl)
+    batch = bulk.MetricsBatch()
+    header = {}
+    batches = 1
+
+    for tr_proto in stream.iter_object():
+        if stream.peek() != '{':
+            header[tr_proto] = stream.read_value()
+            continue
+
+        if header.get('format', 'fulljson') != 'fulljson':
+            raise NotStreamable()
+
+        # report time stamps might not have been seen yet
+        if batch.timestamp is None:
+            batch.timestamp = rollups.get_timestamp(header)
+
+        for tr_endpoint in stream.iter_object():
+            if stream.peek() != '{':
+                stream.read_value()
+                continue
+
+            # peers can not be ranked without reading them all first
+            aggregate_peer = aggregation.PeerAggregator()
+
+            for peer_address in stream.iter_object():
+                engines = stream.read_value()
+
+                if not isinstance(engines, dict):
+                    continue
+
+                bulk.flatten_peer(
+                    batch, (tr_proto, tr_endpoint,
+                            aggregate_peer(peer_address)), engines)
+
+                if len(batch) >= max_rows:
+                    bulk.import_batch(batch, commit=False)
+                    timestamp = batch.timestamp
+                    batch = bulk.MetricsBatch()
+                    batch.timestamp = timestamp
+                    batches += 1
+
+    stream.close()
+
+    if header.get('format') != 'fulljson':
+        raise NotStreamable()
+
+    batch.documents += 1
+
+    bulk.import_batch(batch, commit=False)
+
+    db.session.commit()
+
+    log.info('Streamed metrics document in %d batch(es)' % batches)
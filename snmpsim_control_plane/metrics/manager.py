@@ -6,10 +6,20 @@
 #
 # SNMP Agent Simulator Control Plane: metrics importer manager
 #
+import json
+import time
+
 from snmpsim_control_plane.metrics import db
 from snmpsim_control_plane import log
+from snmpsim_control_plane.metrics import generation
+from snmpsim_control_plane.metrics import rates
+from snmpsim_control_plane.metrics import retention
+from snmpsim_control_plane.metrics import rollups
+from snmpsim_control_plane.metrics.importers import bulk
 from snmpsim_control_plane.metrics.importers import snmpagent
+from snmpsim_control_plane.metrics.importers import streaming
 from snmpsim_control_plane.metrics.importers import process
+from snmpsim_control_plane.metrics.utils import ID_ALLOCATOR
 
 KNOWN_IMPORTERS = {
     'fulljson': snmpagent.import_metrics,
@@ -17,6 +27,15 @@ KNOWN_IMPORTERS = {
 }
 
 
+def _rollback():
+    db.session.rollback()
+
+    # IDs reserved and rows created by the failed transaction
+    # are gone with it
+    ID_ALLOCATOR.reset()
+    bulk.DIMENSION_CACHE.clear()
+
+
 def import_metrics(jsondoc):
     """Update metrics DB from `dict` data structure.
 
@@ -36,4 +55,158 @@ def import_metrics(jsondoc):
     except Exception as exc:
         log.error('Metric importer %s failed: %s' % (flavor, exc))
         log.error('JSON document causing failure is: %s' % jsondoc)
-        db.session.rollback()
+        _rollback()
+        return
+
+    generation.bump()
+
+
+def import_batch(batch):
+    """Update metrics DB from a batch of flattened `fulljson` counters.
+
+    Returns `True` on success.
+    """
+    try:
+        bulk.import_batch(batch)
+
+    except Exception as exc:
+        log.error('Bulk metric importer failed on %d coalesced '
+                  'document(s): %s' % (batch.documents, exc))
+        _rollback()
+        return False
+
+    generation.bump()
+
+    return True
+
+
+def import_stream(fl):
+    """Stream `fulljson` metrics document from file `fl` into metrics DB.
+
+    Returns `None` once the document has been imported. Documents of
+    other formats are parsed as a whole and returned to the caller.
+    """
+    try:
+        streaming.import_metrics(fl)
+
+    except streaming.NotStreamable:
+        _rollback()
+        fl.seek(0)
+        return json.load(fl)
+
+    except Exception as exc:
+        log.error('Streaming metric importer failed on %s: '
+                  '%s' % (getattr(fl, 'name', fl), exc))
+        _rollback()
+        return
+
+    generation.bump()
+
+
+def update_rollups():
+    """Downsample metrics series and expire old series intervals."""
+    try:
+        rollups.update_rollups()
+
+    except Exception as exc:
+        log.error('Metrics series rollup failed: %s' % exc)
+        _rollback()
+        return
+
+    generation.bump()
+
+
+def update_rates():
+    """Sample activity counters and update their rates."""
+    try:
+        rates.update_rates()
+
+    except Exception as exc:
+        log.error('Metrics rates sampling failed: %s' % exc)
+        _rollback()
+        return
+
+    generation.bump()
+
+
+def purge_metrics():
+    """Remove stale metrics from metrics DB."""
+    try:
+        retention.purge_metrics()
+
+    except Exception as exc:
+        log.error('Metrics purge failed: %s' % exc)
+        _rollback()
+        return
+
+    # purged rows might still be cached
+    bulk.DIMENSION_CACHE.clear()
+
+    generation.bump()
+
+
+class ImportCoalescer(object):
+    """Fold many metrics documents into as few DB writes as possible.
+
+    SNMP simulator instances report ever growing counters as increments,
+    so summing up `fulljson` documents before hitting the DB yields the
+    same result as importing them one by one.
+
+    Documents are accumulated until either `window` seconds pass since the
+    first pending document or `max_documents` documents are pending,
+    whichever comes first. Zero `window` makes the caller responsible for
+    flushing e.g. once per directory scan.
+
+    Documents of other formats, as well as all documents on DB engines not
+    supporting bulk import, are imported right away.
+    """
+
+    def __init__(self, window=0, max_documents=100):
+        self._window = window
+        self._max_documents = max_documents
+        self._batch = None
+        self._deadline = None
+
+    @property
+    def deadline(self):
+        """Time by which pending documents should be flushed."""
+        return self._deadline
+
+    def add(self, jsondoc):
+        """Queue metrics document for import."""
+        if jsondoc.get('format') != 'fulljson' or not bulk.is_enabled():
+            import_metrics(jsondoc)
+            return
+
+        try:
+            batch = bulk.flatten_metrics(jsondoc)
+
+        except Exception as exc:
+            log.error('Metric flattening failed: %s' % exc)
+            log.error('JSON document causing failure is: %s' % jsondoc)
+            return
+
+        if self._batch is None:
+            self._batch = batch
+            self._deadline = time.time() + self._window
+
+        else:
+            self._batch.update(batch)
+
+        if self._batch.documents >= self._max_documents:
+            self.flush()
+
+    def expired(self):
+        """Tell whether pending documents are due to be flushed."""
+        return self._batch is not None and self._deadline <= time.time()
+
+    def flush(self):
+        """Import all pending documents at once."""
+        batch, self._batch, self._deadline = self._batch, None, None
+
+        if not batch:
+            return
+
+        if import_batch(batch):
+            log.info('Imported %d metrics document(s) in one '
+                     'write' % batch.documents)
@@ -0,0 +1,285 @@
+#
+# This file is part of SNMP simulator Control Plane software.
+#
+# Copyright (c) 2019-2020, Ilya Etingof <etingof@gmail.com>
+# License: http://snmplabs.com/snmpsim/license.html
+#
+# SNMP simulator metrics: DB schema upgrades
+#
+import datetime
+
+from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
+from sqlalchemy import String
+from sqlalchemy import Table
+from sqlalchemy import inspect
+from sqlalchemy import select
+from sqlalchemy import text
+
+from snmpsim_control_plane import log
+from snmpsim_control_plane.metrics import app
+from snmpsim_control_plane.metrics import db
+from snmpsim_control_plane.metrics import generation
+from snmpsim_control_plane.metrics import models  # noqa
+from snmpsim_control_plane.metrics import rates
+from snmpsim_control_plane.metrics import retention
+from snmpsim_control_plane.metrics import summaries
+from snmpsim_control_plane.metrics.utils import ID_ALLOCATOR
+
+# String columns moved into `Term` dictionary, children go first
+TERM_UPGRADES = (
+    (models.Variation, {
+        'name': ('name_id', models.VARIATION_TERM)}),
+    (models.Pdu, {
+        'name': ('name_id', models.PDU_TYPE_TERM)}),
+    (models.Recording, {
+        'path': ('path_id', models.RECORDING_TERM)}),
+    (models.Agent, {
+        'engine': ('engine_id', models.ENGINE_TERM),
+        'context_engine': ('context_engine_id', models.CONTEXT_ENGINE_TERM),
+        'context_name': ('context_name_id', models.CONTEXT_NAME_TERM)}),
+)
+
+
+def _get_columns(table):
+    inspector = inspect(db.engine)
+
+    if table not in inspector.get_table_names():
+        return
+
+    return set(column['name'] for column in inspector.get_columns(table))
+
+
+def _add_columns(model, *names):
+    table = model.__table__
+
+    columns = _get_columns(table.name)
+    if not columns:
+        return
+
+    for name in names:
+        if name in columns:
+            continue
+
+        log.info('Adding column %s to table %s' % (name, table.name))
+
+        column_type = table.c[name].type.compile(dialect=db.engine.dialect)
+
+        db.session.execute(
+            text('ALTER TABLE %s ADD COLUMN %s %s' % (
+                table.name, name, column_type)))
+
+        if name == 'last_update':
+            # existing rows should not go stale right away
+            db.session.execute(
+                table.update().values(
+                    last_update=datetime.datetime.utcnow()))
+
+    db.session.commit()
+
+
+def _create_indexes():
+    inspector = inspect(db.engine)
+
+    tables = inspector.get_table_names()
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+
+        indexes = set(
+            index['name'] for index in inspector.get_indexes(table.name))
+
+        for index in table.indexes:
+            if index.name in indexes:
+                continue
+
+            log.info('Creating index %s on table %s' % (
+                index.name, table.name))
+
+            index.create(bind=db.session.connection())
+
+    db.session.commit()
+
+
+def _enable_incremental_vacuum():
+    if db.engine.dialect.name != 'sqlite':
+        return
+
+    auto_vacuum = db.session.execute(text('PRAGMA auto_vacuum')).scalar()
+
+    if auto_vacuum == retention.SQLITE_AUTO_VACUUM_INCREMENTAL:
+        return
+
+    log.info('Enabling incremental vacuum, this may take a while')
+
+    db.session.execute(text(
+        'PRAGMA auto_vacuum = %d' % retention.SQLITE_AUTO_VACUUM_INCREMENTAL))
+
+    # takes effect only once the whole DB is rebuilt
+    db.session.execute(text('VACUUM'))
+
+    db.session.commit()
+
+
+def _upgrade_console_pages():
+    """Move console pages into compressed ring buffer slots.
+
+    Returns a list of console pages to be put back once the new
+    table is created.
+    """
+    columns = _get_columns(models.ConsolePage.__table__.name)
+
+    if not columns or 'slot' in columns:
+        return []
+
+    log.info('Moving console pages into ring buffers')
+
+    table = Table(
+        models.ConsolePage.__table__.name, MetaData(),
+        Column('id', Integer()),
+        Column('text', String()),
+        Column('timestamp', DateTime()),
+        Column('process_id', Integer()))
+
+    pages = db.session.execute(
+        select([table.c.process_id, table.c.timestamp, table.c.text])
+        .order_by(table.c.process_id, table.c.timestamp, table.c.id)
+    ).fetchall()
+
+    db.session.execute(text('DROP TABLE %s' % table.name))
+
+    db.session.commit()
+
+    return pages
+
+
+def _restore_console_pages(pages):
+    ring_size = app.config['SNMPSIM_METRICS_CONSOLE_RING_SIZE']
+
+    pages_by_process = {}
+
+    for process_id, timestamp, page_text in pages:
+        pages_by_process.setdefault(process_id, []).append(
+            (timestamp, page_text))
+
+    for process_id, process_pages in pages_by_process.items():
+        process_pages = process_pages[-ring_size:]
+
+        ids = ID_ALLOCATOR.allocate(models.ConsolePage, len(process_pages))
+
+        for slot, (timestamp, page_text) in enumerate(process_pages):
+            db.session.add(
+                models.ConsolePage(
+                    id=ids[slot], slot=slot, timestamp=timestamp,
+                    text=page_text, process_id=process_id))
+
+        db.session.query(models.Process).filter(
+            models.Process.id == process_id
+        ).update({'console_position': len(process_pages)},
+                 synchronize_session=False)
+
+    db.session.commit()
+
+
+def _upgrade_terms():
+    """Move repeated strings out of metrics tables into `Term` dictionary.
+
+    Returns a list of `(model, interned columns, rows)` tuples to be put
+    back once the new tables are created.
+    """
+    upgrades = []
+
+    for model, interned in TERM_UPGRADES:
+        name = model.__table__.name
+
+        columns = _get_columns(name)
+
+        if not columns or not set(interned).issubset(columns):
+            continue
+
+        log.info('Moving %s strings into dictionary' % name)
+
+        table = Table(
+            name, MetaData(), autoload=True,
+            autoload_with=db.session.connection())
+
+        rows = [dict(row) for row in db.session.execute(select([table]))]
+
+        upgrades.append((model, interned, rows))
+
+    for model, _, _ in upgrades:
+        # PostgreSQL would not drop tables still referred to
+        db.session.execute(text('DROP TABLE %s%s' % (
+            model.__table__.name,
+            ' CASCADE' if db.engine.dialect.name == 'postgresql' else '')))
+
+    db.session.commit()
+
+    return upgrades
+
+
+def _restore_terms(upgrades):
+    terms = {}
+
+    for _, interned, rows in upgrades:
+        for column, (_, kind) in interned.items():
+            for row in rows:
+                terms[(kind, row[column])] = None
+
+    ids = ID_ALLOCATOR.allocate(models.Term, len(terms))
+
+    for term_id, term in zip(ids, terms):
+        terms[term] = term_id
+
+    if terms:
+        db.session.execute(
+            models.Term.__table__.insert(),
+            [{'id': term_id, 'kind': kind, 'value': value}
+             for (kind, value), term_id in terms.items()])
+
+    for model, interned, rows in reversed(upgrades):
+        for row in rows:
+            for column, (term_column, kind) in interned.items():
+                row[term_column] = terms[(kind, row.pop(column))]
+
+        if rows:
+            db.session.execute(model.__table__.insert(), rows)
+
+    db.session.commit()
+
+
+def upgrade_db():
+    """Bring existing metrics DB up to date with current models.
+
+    Unlike DB recreation, upgrade preserves already collected metrics.
+    """
+    _add_columns(models.Process, 'console_position')
+    _add_columns(models.Transport, 'last_update')
+    _add_columns(models.Supervisor, 'last_update')
+    _add_columns(models.Process, 'cpu_rate', 'exits_rate', 'swap_latency')
+
+    for model, _ in rates.RATES:
+        _add_columns(model, 'sample', 'sample_time', 'rate')
+
+    console_pages = _upgrade_console_pages()
+
+    term_upgrades = _upgrade_terms()
+
+    log.info('Creating missing DB tables')
+
+    db.create_all()
+
+    _create_indexes()
+
+    _restore_console_pages(console_pages)
+
+    _restore_terms(term_upgrades)
+
+    summaries.rebuild()
+
+    _enable_incremental_vacuum()
+
+    generation.bump()
@@ -6,6 +6,8 @@
 #
 # SNMP simulator metrics: ORM models
 #
+import zlib
+
 from snmpsim_control_plane.metrics import db
 
 
@@ -14,6 +16,7 @@ class Transport(db.Model):
     transport_protocol = db.Column(db.String(8), nullable=False)
     endpoint = db.Column(db.String(64), nullable=False)
     peer = db.Column(db.String(64), nullable=False)
+    last_update = db.Column(db.DateTime())
 
     packets = db.relationship(
         'Packet', cascade="all,delete", backref='transports', lazy='select')
@@ -23,6 +26,8 @@ class Transport(db.Model):
         db.PrimaryKeyConstraint(
             'transport_protocol', 'endpoint', 'peer'
         ),
+        db.Index('transport_endpoint_peer', 'endpoint', 'peer'),
+        db.Index('transport_peer', 'peer'),
     )
 
 
@@ -31,6 +36,10 @@ class Packet(db.Model):
     parse_failures = db.Column(db.BigInteger)
     auth_failures = db.Column(db.BigInteger)
     context_failures = db.Column(db.BigInteger)
+    # `total` as of last rate sample and its change per second since then
+    sample = db.Column(db.BigInteger)
+    sample_time = db.Column(db.Integer())
+    rate = db.Column(db.Float())
 
     transport_id = db.Column(
         db.Integer, db.ForeignKey("transport.id"), nullable=False)
@@ -42,15 +51,45 @@ class Packet(db.Model):
     )
 
 
+class Term(db.Model):
+    """Interned string value of a search dimension.
+
+    Metrics rows refer to repeated strings (SNMP engine IDs, context
+    names, recording paths, PDU types and variation modules) by term ID.
+    """
+    id = db.Column(db.Integer(), unique=True)
+    kind = db.Column(db.String(16), nullable=False)
+    value = db.Column(db.String(), nullable=False)
+
+    # Sqlalchemy's merge requires unique fields to be primary keys
+    __table_args__ = (
+        db.PrimaryKeyConstraint(
+            'kind', 'value'
+        ),
+    )
+
+
+# `Term` kinds
+ENGINE_TERM = 'engine'
+CONTEXT_ENGINE_TERM = 'context_engine'
+CONTEXT_NAME_TERM = 'context_name'
+RECORDING_TERM = 'recording'
+PDU_TYPE_TERM = 'pdu_type'
+VARIATION_TERM = 'variation'
+
+
 class Agent(db.Model):
     id = db.Column(db.Integer(), unique=True)
     transport_id = db.Column(
         db.Integer, db.ForeignKey("transport.id"), nullable=False)
-    engine = db.Column(db.String(64), nullable=False)
+    engine_id = db.Column(
+        db.Integer, db.ForeignKey("term.id"), nullable=False)
     security_model = db.Column(db.Integer(), nullable=False)
     security_level = db.Column(db.Integer(), nullable=False)
-    context_engine = db.Column(db.String(64), nullable=False)
-    context_name = db.Column(db.String(64), nullable=False)
+    context_engine_id = db.Column(
+        db.Integer, db.ForeignKey("term.id"), nullable=False)
+    context_name_id = db.Column(
+        db.Integer, db.ForeignKey("term.id"), nullable=False)
 
     recordings = db.relationship(
         'Recording', cascade="all,delete", backref='agent', lazy='select')
@@ -58,15 +97,22 @@ class Agent(db.Model):
     # Sqlalchemy's merge requires unique fields to be primary keys
     __table_args__ = (
         db.PrimaryKeyConstraint(
-            'transport_id', 'engine', 'security_model', 'security_level',
-            'context_engine', 'context_name'
+            'transport_id', 'engine_id', 'security_model', 'security_level',
+            'context_engine_id', 'context_name_id'
         ),
+        db.Index('agent_engine_security',
+                 'engine_id', 'security_model', 'security_level'),
+        db.Index('agent_security_model', 'security_model', 'security_level'),
+        db.Index('agent_security_level', 'security_level'),
+        db.Index('agent_context', 'context_engine_id', 'context_name_id'),
+        db.Index('agent_context_name', 'context_name_id'),
     )
 
 
 class Recording(db.Model):
     id = db.Column(db.Integer(), unique=True)
-    path = db.Column(db.String(16), nullable=False)
+    path_id = db.Column(
+        db.Integer, db.ForeignKey("term.id"), nullable=False)
 
     agent_id = db.Column(
         db.Integer, db.ForeignKey("agent.id"), nullable=False)
@@ -76,15 +122,21 @@ class Recording(db.Model):
 
     __table_args__ = (
         db.PrimaryKeyConstraint(
-            'agent_id', 'path'
+            'agent_id', 'path_id'
         ),
+        db.Index('recording_path', 'path_id', 'agent_id'),
     )
 
 
 class Pdu(db.Model):
     id = db.Column(db.Integer(), unique=True)
-    name = db.Column(db.String(16), nullable=False)
+    name_id = db.Column(
+        db.Integer, db.ForeignKey("term.id"), nullable=False)
     total = db.Column(db.BigInteger)
+    # `total` as of last rate sample and its change per second since then
+    sample = db.Column(db.BigInteger)
+    sample_time = db.Column(db.Integer())
+    rate = db.Column(db.Float())
 
     recording_id = db.Column(
         db.Integer, db.ForeignKey("recording.id"), nullable=False)
@@ -96,8 +148,9 @@ class Pdu(db.Model):
 
     __table_args__ = (
         db.PrimaryKeyConstraint(
-            'recording_id', 'name'
+            'recording_id', 'name_id'
         ),
+        db.Index('pdu_name', 'name_id', 'recording_id'),
     )
 
 
@@ -115,7 +168,8 @@ class VarBind(db.Model):
 
 
 class Variation(db.Model):
-    name = db.Column(db.String(64), nullable=False)
+    name_id = db.Column(
+        db.Integer, db.ForeignKey("term.id"), nullable=False)
     total = db.Column(db.BigInteger)
     failures = db.Column(db.BigInteger)
     pdu_id = db.Column(
@@ -123,7 +177,137 @@ class Variation(db.Model):
 
     __table_args__ = (
         db.PrimaryKeyConstraint(
-            'pdu_id', 'name'
+            'pdu_id', 'name_id'
+        ),
+    )
+
+
+class PacketSeries(db.Model):
+    """Packet counters accumulated within a time interval.
+
+    The interval starts at `timestamp` (seconds since epoch) and lasts
+    `resolution` seconds.
+    """
+    resolution = db.Column(db.Integer(), nullable=False)
+    timestamp = db.Column(db.Integer(), nullable=False)
+    total = db.Column(db.BigInteger)
+    parse_failures = db.Column(db.BigInteger)
+    auth_failures = db.Column(db.BigInteger)
+    context_failures = db.Column(db.BigInteger)
+
+    transport_id = db.Column(
+        db.Integer, db.ForeignKey("transport.id"), nullable=False)
+
+    __table_args__ = (
+        db.PrimaryKeyConstraint(
+            'resolution', 'timestamp', 'transport_id'
+        ),
+    )
+
+
+class MessageSeries(db.Model):
+    """PDU and variable-bindings counters accumulated within a time interval.
+
+    The interval starts at `timestamp` (seconds since epoch) and lasts
+    `resolution` seconds.
+    """
+    resolution = db.Column(db.Integer(), nullable=False)
+    timestamp = db.Column(db.Integer(), nullable=False)
+    pdus = db.Column(db.BigInteger)
+    var_binds = db.Column(db.BigInteger)
+    failures = db.Column(db.BigInteger)
+
+    pdu_id = db.Column(
+        db.Integer, db.ForeignKey("pdu.id"), nullable=False)
+
+    __table_args__ = (
+        db.PrimaryKeyConstraint(
+            'resolution', 'timestamp', 'pdu_id'
+        ),
+    )
+
+
+class SeriesRollup(db.Model):
+    """Downsampling progress of a series resolution.
+
+    Intervals of this resolution starting from `dirty_since` might be
+    out of date with the finer resolution they are built from.
+    """
+    resolution = db.Column(db.Integer(), nullable=False)
+    dirty_since = db.Column(db.Integer())
+
+    __table_args__ = (
+        db.PrimaryKeyConstraint('resolution'),
+    )
+
+
+class PacketSummary(db.Model):
+    """Packet counters summed up by the value of a search dimension.
+
+    Grand totals are kept under empty `dimension` and `value`.
+    """
+    dimension = db.Column(db.String(32), nullable=False)
+    value = db.Column(db.String(), nullable=False)
+    total = db.Column(db.BigInteger)
+    parse_failures = db.Column(db.BigInteger)
+    auth_failures = db.Column(db.BigInteger)
+    context_failures = db.Column(db.BigInteger)
+    # `total` as of last rate sample and its change per second since then
+    sample = db.Column(db.BigInteger)
+    sample_time = db.Column(db.Integer())
+    rate = db.Column(db.Float())
+
+    __table_args__ = (
+        db.PrimaryKeyConstraint(
+            'dimension', 'value'
+        ),
+        db.Index('packet_summary_total', 'dimension', 'total', 'value'),
+    )
+
+
+class MessageSummary(db.Model):
+    """PDU and variable-bindings counters summed up by the value of a
+    search dimension.
+
+    Grand totals are kept under empty `dimension` and `value`.
+    """
+    dimension = db.Column(db.String(32), nullable=False)
+    value = db.Column(db.String(), nullable=False)
+    pdus = db.Column(db.BigInteger)
+    var_binds = db.Column(db.BigInteger)
+    failures = db.Column(db.BigInteger)
+    # `pdus` as of last rate sample and its change per second since then
+    sample = db.Column(db.BigInteger)
+    sample_time = db.Column(db.Integer())
+    rate = db.Column(db.Float())
+
+    __table_args__ = (
+        db.PrimaryKeyConstraint(
+            'dimension', 'value'
+        ),
+        db.Index('message_summary_pdus', 'dimension', 'pdus', 'value'),
+        db.Index(
+            'message_summary_var_binds', 'dimension', 'var_binds', 'value'),
+        db.Index(
+            'message_summary_failures', 'dimension', 'failures', 'value'),
+    )
+
+
+class VariationSummary(db.Model):
+    """Variation module counters summed up by the value of a search
+    dimension.
+
+    Grand totals are kept under empty `dimension` and `value`.
+    """
+    dimension = db.Column(db.String(32), nullable=False)
+    value = db.Column(db.String(), nullable=False)
+    name = db.Column(db.String(64), nullable=False)
+    total = db.Column(db.BigInteger)
+    failures = db.Column(db.BigInteger)
+
+    __table_args__ = (
+        db.PrimaryKeyConstraint(
+            'dimension', 'value', 'name'
         ),
     )
 
@@ -140,15 +324,30 @@ class Endpoint(db.Model):
 
 
 class ConsolePage(db.Model):
+    """Console page kept in one of per-process ring buffer slots.
+
+    Page text is stored zlib-compressed. Whenever a slot gets reused,
+    the page occupying it is overwritten and gets a new ID.
+    """
     id = db.Column(db.Integer(), unique=True)
-    text = db.Column(db.String(), nullable=False)
+    slot = db.Column(db.Integer(), nullable=False)
+    compressed_text = db.Column(db.LargeBinary(), nullable=False)
     timestamp = db.Column(db.DateTime(), nullable=False)
     process_id = db.Column(db.Integer(), db.ForeignKey('process.id'))
 
     __table_args__ = (
-        db.PrimaryKeyConstraint('id', 'process_id'),
+        db.PrimaryKeyConstraint('process_id', 'slot'),
+        db.Index('console_page_process_timestamp', 'process_id', 'timestamp'),
     )
 
+    @property
+    def text(self):
+        return zlib.decompress(self.compressed_text).decode('utf-8')
+
+    @text.setter
+    def text(self, text):
+        self.compressed_text = zlib.compress(text.encode('utf-8'))
+
 
 class Process(db.Model):
     id = db.Column(db.Integer(), unique=True)
@@ -161,12 +360,20 @@ class Process(db.Model):
     changes = db.Column(db.Integer())
     last_update = db.Column(db.DateTime())
     update_interval = db.Column(db.Integer())
+    # over last update interval, in ms per second and exits per hour
+    cpu_rate = db.Column(db.Float())
+    exits_rate = db.Column(db.Float())
+    # how long the last overlapping restart took, in ms
+    swap_latency = db.Column(db.Integer())
+    # total number of console pages ever written into the ring
+    console_position = db.Column(db.BigInteger())
     supervisor_id = db.Column(db.Integer(), db.ForeignKey('supervisor.id'))
 
     endpoints = db.relationship(
         'Endpoint', backref='process', lazy='select')
     console_pages = db.relationship(
-        'ConsolePage', backref='process', lazy='select')
+        'ConsolePage', backref='process', lazy='select',
+        order_by='ConsolePage.timestamp')
 
     __table_args__ = (
         db.PrimaryKeyConstraint('supervisor_id', 'path'),
@@ -178,6 +385,7 @@ class Supervisor(db.Model):
     hostname = db.Column(db.String(), nullable=False)
     watch_dir = db.Column(db.String(), nullable=False)
     started = db.Column(db.DateTime())
+    last_update = db.Column(db.DateTime())
 
     processes = db.relationship(
         'Process', backref='supervisor', lazy='select')
@@ -185,3 +393,12 @@ class Supervisor(db.Model):
     __table_args__ = (
         db.PrimaryKeyConstraint('hostname'),
     )
+
+
+class IdAllocation(db.Model):
+    model = db.Column(db.String(32), nullable=False)
+    next_id = db.Column(db.BigInteger(), nullable=False)
+
+    __table_args__ = (
+        db.PrimaryKeyConstraint('model'),
+    )
@@ -0,0 +1,125 @@
+#
+# This file is part of SNMP simulator Control Plane software.
+#
+# Copyright (c) 2019-2020, Ilya Etingof <etingof@gmail.com>
+# License: http://snmplabs.com/snmpsim/license.html
+#
+# SNMP simulator metrics: search query plans checking
+#
+import re
+import sqlite3
+
+from sqlalchemy import text
+
+from snmpsim_control_plane import error
+from snmpsim_control_plane import log
+from snmpsim_control_plane.metrics import app
+from snmpsim_control_plane.metrics import db
+from snmpsim_control_plane.metrics import views
+
+# Any search term value would do for query planning
+SEARCH_VALUE = '0'
+
+POSTGRESQL_SEQ_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+def _compile(query):
+    return str(query.statement.compile(
+        dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+
+
+def _explain_sqlite(queries):
+    # Given statistics of small or uniform data, the planner would rightly
+    # prefer full scans. Plan queries against empty copy of the schema.
+    schema = db.session.execute(text(
+        "SELECT sql FROM sqlite_master "
+        "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'")).fetchall()
+
+    conn = sqlite3.connect(':memory:')
+
+    try:
+        conn.executescript(';\n'.join(row[0] for row in schema))
+
+        for field, field_queries in queries.items():
+            scans = set()
+
+            for query in field_queries:
+                for row in conn.execute(
+                        'EXPLAIN QUERY PLAN ' + _compile(query)):
+                    detail = row[-1]
+
+                    if (detail.startswith('SCAN ') and
+                            not detail.startswith('SCAN CONSTANT')):
+                        scans.add(detail.split()[1])
+
+            yield field, scans
+
+    finally:
+        conn.close()
+
+
+def _explain_postgresql(queries):
+    # tables too small would be scanned otherwise
+    db.session.execute(text('SET LOCAL enable_seqscan = off'))
+
+    try:
+        for field, field_queries in queries.items():
+            scans = set()
+
+            for query in field_queries:
+                for row in db.session.execute(
+                        text('EXPLAIN ' + _compile(query))):
+                    match = POSTGRESQL_SEQ_SCAN.search(row[0])
+                    if match:
+                        scans.add(match.group(1))
+
+            yield field, scans
+
+    finally:
+        db.session.rollback()
+
+
+def check_query_plans():
+    """Tell which search terms make metrics queries scan whole tables.
+
+    Queries joining metrics tables are planned with each search term
+    on its own. Those are the queries REST API runs whenever summaries
+    can not answer, that is when more than one search term is given.
+
+    Returns a dict mapping search terms onto the names of the tables
+    scanned.
+    """
+    queries = {}
+
+    for field in views.QS_COLUMN_MAP:
+        with app.test_request_context(query_string={field: SEARCH_VALUE}):
+            queries[field] = list(views.query_messages())
+
+            if field in views.PACKETS_QS_COLUMN_MAP:
+                queries[field].append(views.query_packets())
+
+    dialect = db.engine.dialect.name
+
+    if dialect == 'sqlite':
+        plans = _explain_sqlite(queries)
+
+    elif dialect == 'postgresql':
+        plans = _explain_postgresql(queries)
+
+    else:
+        raise error.ControlPlaneError(
+            'Query plans can not be checked on %s' % dialect)
+
+    report = {}
+
+    for field, scans in plans:
+        report[field] = sorted(scans)
+
+        if scans:
+            log.error('Search term %s makes metrics DB scan table(s) %s' % (
+                field, ', '.join(sorted(scans))))
+
+    log.info('Checked query plans of %d search terms, %d scan whole '
+             'tables' % (len(report), len([x for x in report if report[x]])))
+
+    return report
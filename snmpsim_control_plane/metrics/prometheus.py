@@ -0,0 +1,193 @@
+#
+# This file is part of SNMP simulator Control Plane software.
+#
+# Copyright (c) 2019-2020, Ilya Etingof <etingof@gmail.com>
+# License: http://snmplabs.com/snmpsim/license.html
+#
+# SNMP simulator metrics: Prometheus text exposition
+#
+from sqlalchemy import select
+
+from snmpsim_control_plane import error
+from snmpsim_control_plane.metrics import app
+from snmpsim_control_plane.metrics import db
+from snmpsim_control_plane.metrics import generation
+from snmpsim_control_plane.metrics import models
+from snmpsim_control_plane.metrics import summaries
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# (metric name, metric type, help text)
+PACKET_METRICS = (
+    ('snmpsim_packets_total', 'counter',
+     'SNMP packets received'),
+    ('snmpsim_packet_parse_failures_total', 'counter',
+     'SNMP packets failed to parse'),
+    ('snmpsim_packet_auth_failures_total', 'counter',
+     'SNMP packets failed to authenticate'),
+    ('snmpsim_packet_context_failures_total', 'counter',
+     'SNMP packets addressing unknown SNMP context'),
+)
+
+MESSAGE_METRICS = (
+    ('snmpsim_pdus_total', 'counter',
+     'SNMP PDUs processed'),
+    ('snmpsim_var_binds_total', 'counter',
+     'SNMP variable-bindings processed'),
+    ('snmpsim_var_bind_failures_total', 'counter',
+     'SNMP variable-bindings failed to process'),
+)
+
+VARIATION_METRICS = (
+    ('snmpsim_variation_calls_total', 'counter',
+     'Variation module calls'),
+    ('snmpsim_variation_failures_total', 'counter',
+     'Variation module failures'),
+)
+
+# (metric name, metric type, help text, `Process` column, scale)
+PROCESS_METRICS = (
+    ('snmpsim_process_virtual_memory_bytes', 'gauge',
+     'Virtual memory size of SNMP simulator process', 'memory',
+     1024 * 1024),
+    ('snmpsim_process_cpu_seconds_total', 'counter',
+     'CPU time consumed by SNMP simulator process', 'cpu', 0.001),
+    ('snmpsim_process_open_files', 'gauge',
+     'Files opened by SNMP simulator process', 'files', 1),
+    ('snmpsim_process_exits_total', 'counter',
+     'SNMP simulator process exits', 'exits', 1),
+    ('snmpsim_process_runtime_seconds_total', 'counter',
+     'SNMP simulator process run time', 'runtime', 1),
+    ('snmpsim_process_swap_latency_seconds', 'gauge',
+     'Time the last overlapping restart of SNMP simulator process took',
+     'swap_latency', 0.001),
+)
+
+_snapshots = {}
+
+
+def _escape(value):
+    return ('%s' % value).replace(
+        '\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_sample(name, labels, value):
+    return '%s{%s} %s' % (
+        name, ','.join('%s="%s"' % (label, _escape(label_value))
+                       for label, label_value in labels),
+        value)
+
+
+def _add_samples(families, metrics, labels, rows):
+    """Add rows of label values followed by metric values to families."""
+    for row in rows:
+        row_labels = list(zip(labels, row))
+
+        for idx, (name, _, _) in enumerate(metrics):
+            families[name].append(
+                _format_sample(name, row_labels, row[len(labels) + idx] or 0))
+
+
+def render():
+    """Render current metrics in Prometheus text exposition format."""
+    families = dict(
+        (name, []) for name, _, _ in
+        PACKET_METRICS + MESSAGE_METRICS + VARIATION_METRICS)
+
+    packet = models.Packet.__table__
+    pdu = models.Pdu.__table__
+    varbind = models.VarBind.__table__
+    variation = models.Variation.__table__
+
+    variation_term = summaries.TERMS[models.VARIATION_TERM]
+
+    labels = [name for name, _ in summaries.PACKET_DIMENSIONS]
+    columns = [column for _, column in summaries.PACKET_DIMENSIONS]
+
+    _add_samples(
+        families, PACKET_METRICS, labels, db.session.execute(
+            select(columns + [packet.c.total, packet.c.parse_failures,
+                              packet.c.auth_failures,
+                              packet.c.context_failures])
+            .select_from(summaries.join_packets())))
+
+    labels = [name for name, _ in summaries.MESSAGE_DIMENSIONS]
+    columns = [column for _, column in summaries.MESSAGE_DIMENSIONS]
+
+    _add_samples(
+        families, MESSAGE_METRICS, labels, db.session.execute(
+            select(columns + [pdu.c.total, varbind.c.total,
+                              varbind.c.failures])
+            .select_from(
+                summaries.join_pdus()
+                .join(varbind, varbind.c.pdu_id == pdu.c.id))))
+
+    _add_samples(
+        families, VARIATION_METRICS, labels + ['variation'],
+        db.session.execute(
+            select(columns + [variation_term.c.value, variation.c.total,
+                              variation.c.failures])
+            .select_from(
+                summaries.join_pdus()
+                .join(variation, variation.c.pdu_id == pdu.c.id)
+                .join(variation_term,
+                      variation_term.c.id == variation.c.name_id))))
+
+    processes = (
+        models.Process
+        .query
+        .join(models.Supervisor)
+        .with_entities(
+            models.Supervisor.hostname, models.Process.path,
+            *[getattr(models.Process, column)
+              for _, _, _, column, _ in PROCESS_METRICS])
+        .all())
+
+    lines = []
+
+    for name, metric_type, description in (
+            PACKET_METRICS + MESSAGE_METRICS + VARIATION_METRICS):
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, metric_type))
+        lines.extend(families[name])
+
+    for idx, (name, metric_type, description, _, scale) in enumerate(
+            PROCESS_METRICS):
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, metric_type))
+
+        for process in processes:
+            lines.append(
+                _format_sample(
+                    name, (('hostname', process[0]), ('path', process[1])),
+                    (process[2 + idx] or 0) * scale))
+
+    lines.append('')
+
+    return '\n'.join(lines)
+
+
+def get_snapshot():
+    """Return metrics in Prometheus text exposition format.
+
+    Once rendered, metrics text is reused for as long as metrics DB
+    generation stays the same. Without generation tracking, metrics
+    are rendered every time.
+    """
+    try:
+        current = generation.get_generation()
+
+    except error.ControlPlaneError as exc:
+        app.logger.error(exc)
+        current = None
+
+    snapshot = _snapshots.get(current)
+
+    if snapshot is None:
+        snapshot = render()
+
+        if current is not None:
+            _snapshots.clear()
+            _snapshots[current] = snapshot
+
+    return snapshot
@@ -0,0 +1,76 @@
+#
+# This file is part of SNMP simulator Control Plane software.
+#
+# Copyright (c) 2019-2020, Ilya Etingof <etingof@gmail.com>
+# License: http://snmplabs.com/snmpsim/license.html
+#
+# SNMP simulator metrics: activity rates sampling
+#
+import time
+
+from sqlalchemy import Float
+from sqlalchemy import case
+from sqlalchemy import cast
+from sqlalchemy import or_
+
+from snmpsim_control_plane import log
+from snmpsim_control_plane.metrics import app
+from snmpsim_control_plane.metrics import db
+from snmpsim_control_plane.metrics import models
+
+# (model, counter to take rate of)
+RATES = (
+    (models.Packet, 'total'),
+    (models.Pdu, 'total'),
+    (models.PacketSummary, 'total'),
+    (models.MessageSummary, 'pdus'),
+)
+
+
+def _sample(model, counter, now, period):
+    table = model.__table__
+    counter = table.c[counter]
+
+    query = (
+        table.update()
+        .where(or_(table.c.sample_time.is_(None),
+                   table.c.sample_time <= now - period))
+        .values(
+            rate=case(
+                [(table.c.sample_time.is_(None), None),
+                 # counters start over once summaries are rebuilt
+                 (counter < table.c.sample, 0)],
+                else_=(cast(counter - table.c.sample, Float) /
+                       (now - table.c.sample_time))),
+            sample=counter,
+            sample_time=now))
+
+    return db.session.execute(query).rowcount
+
+
+def update_rates():
+    """Sample activity counters, update their per second rates.
+
+    Counters not sampled for at least `SNMPSIM_METRICS_RATE_PERIOD`
+    seconds get their rates recomputed from the change since previous
+    sample. Counters not changing any more drop to zero rates.
+
+    Returns the number of rows sampled.
+    """
+    started = time.time()
+
+    now = int(started)
+
+    period = max(1, app.config['SNMPSIM_METRICS_RATE_PERIOD'])
+
+    sampled = 0
+
+    for model, counter in RATES:
+        sampled += _sample(model, counter, now, period)
+
+    db.session.commit()
+
+    log.info('Sampled %d activity counters in %.2f sec' % (
+        sampled, time.time() - started))
+
+    return sampled
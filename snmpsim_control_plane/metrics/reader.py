@@ -6,15 +6,36 @@
 #
 # SNMP Agent Simulator Control Plane: metrics files reader
 #
-import os
+import collections
 import json
+import multiprocessing
+import os
+import re
 import time
+import uuid
+import zlib
 
+from snmpsim_control_plane import error
+from snmpsim_control_plane import inotify
 from snmpsim_control_plane import log
+from snmpsim_control_plane.metrics import app
+from snmpsim_control_plane.metrics import db
 from snmpsim_control_plane.metrics import manager
+from snmpsim_control_plane.metrics.importers import bulk
 
 POLL_PERIOD = 10
 
+THROUGHPUT_REPORT_PERIOD = 60
+
+# Per-worker inbox directories live here, within watch directory
+WORKERS_DIR = '.workers'
+
+WORKERS_CHECK_PERIOD = 10
+
+PEEK_SIZE = 4096
+
+PRODUCER_RE = re.compile(r'"producer"\s*:\s*"([^"]*)"')
+
 
 def _traverse_dir(dir):
     files = []
@@ -31,40 +52,374 @@ def _traverse_dir(dir):
     return files
 
 
-def watch_metrics(watch_dir):
+def _is_large(filename):
+    threshold = app.config['SNMPSIM_METRICS_STREAMING_THRESHOLD']
 
-    log.info('Watching directory %s' % watch_dir)
+    return (threshold and os.path.getsize(filename) >= threshold and
+            bulk.is_enabled())
 
-    while True:
+
+def _import_files(files, coalescer):
+    """Load, remove and queue metrics files for import.
+
+    Returns the number of metrics documents read.
+    """
+    documents = 0
+
+    for filename in files:
+
+        log.info('Processing %s' % filename)
 
         try:
-            files = _traverse_dir(watch_dir)
+            with open(filename) as fl:
+                if _is_large(filename):
+                    jsondoc = manager.import_stream(fl)
+
+                else:
+                    jsondoc = json.loads(fl.read())
 
         except Exception as exc:
-            log.error('Directory %s traversal failure: %s' % (watch_dir, exc))
-            time.sleep(10)
+            log.error('Error reading file %s: %s' % (filename, exc))
             continue
 
-        for filename in files:
+        finally:
+            try:
+                os.unlink(filename)
+
+            except OSError:
+                pass
+
+        documents += 1
+
+        if jsondoc is None:
+            continue
+
+        try:
+            coalescer.add(jsondoc)
+
+        except Exception as exc:
+            log.error('Error processing file %s: %s' % (filename, exc))
+            continue
+
+    return documents
+
+
+def _peek_producer(filename):
+    """Find out producer UUID of a metrics file without parsing it.
+
+    Producer is normally dumped near the beginning of the document,
+    so that the rest of the file is only read if it is not there.
+    """
+    with open(filename) as fl:
+        text = fl.read(PEEK_SIZE)
+
+        match = PRODUCER_RE.search(text)
+        if not match:
+            match = PRODUCER_RE.search(text + fl.read())
+
+    return match.group(1) if match else ''
+
+
+class MaintenanceScheduler(object):
+    """Periodically downsample series, sample rates and purge stale metrics."""
+
+    def __init__(self, maintenance=True):
+        now = time.time()
+        self._next_rollup = now if maintenance else None
+        self._next_rates = now if maintenance else None
+        self._next_purge = now if maintenance else None
+
+    @property
+    def deadline(self):
+        """Time by which `tick` should be called."""
+        if self._next_rollup is None:
+            return
+
+        return min(self._next_rollup, self._next_rates, self._next_purge)
+
+    def tick(self):
+        if self._next_rollup is None:
+            return
+
+        if self._next_rollup <= time.time():
+            manager.update_rollups()
+
+            self._next_rollup = (
+                time.time() + app.config['SNMPSIM_METRICS_ROLLUP_PERIOD'])
+
+        if self._next_rates <= time.time():
+            manager.update_rates()
+
+            self._next_rates = (
+                time.time() + app.config['SNMPSIM_METRICS_RATE_PERIOD'])
+
+        if self._next_purge <= time.time():
+            manager.purge_metrics()
+
+            self._next_purge = (
+                time.time() + app.config['SNMPSIM_METRICS_RETENTION_PERIOD'])
+
+
+class MetricsImporter(MaintenanceScheduler):
+    """Import metrics files into metrics DB.
+
+    Keeps track of own throughput and reports it every
+    `THROUGHPUT_REPORT_PERIOD` seconds.
+    """
+
+    def __init__(self, name='Importer', maintenance=True):
+        super(MetricsImporter, self).__init__(maintenance)
+        self._name = name
+        self._coalescer = manager.ImportCoalescer(
+            window=app.config['SNMPSIM_METRICS_COALESCE_WINDOW'],
+            max_documents=app.config[
+                'SNMPSIM_METRICS_COALESCE_MAX_DOCUMENTS'])
+        self._documents = 0
+        self._since = time.time()
+
+    @property
+    def deadline(self):
+        """Time by which `tick` should be called."""
+        deadlines = [deadline for deadline in (
+            self._coalescer.deadline,
+            super(MetricsImporter, self).deadline)
+            if deadline is not None]
+
+        return min(deadlines) if deadlines else None
+
+    def process(self, files):
+        self._documents += _import_files(files, self._coalescer)
+
+    def tick(self):
+        if self._coalescer.expired():
+            self._coalescer.flush()
+
+        super(MetricsImporter, self).tick()
+
+        now = time.time()
+
+        if now - self._since < THROUGHPUT_REPORT_PERIOD:
+            return
+
+        if self._documents:
+            log.info('%s processed %d metrics document(s) in %d seconds '
+                     '(%.2f per second)' % (
+                         self._name, self._documents, now - self._since,
+                         self._documents / (now - self._since)))
+
+        self._documents = 0
+        self._since = now
+
+
+def _run_worker(number, inbox, method):
+    # DB connections inherited from the parent can not be shared
+    db.engine.dispose()
+
+    # series are downsampled by the dispatcher
+    WATCH_METHODS[method](
+        inbox, MetricsImporter('Worker #%d' % number, maintenance=False))
+
+
+class MetricsDispatcher(MaintenanceScheduler):
+    """Distribute metrics files among importer worker processes.
 
-            log.info('Processing %s' % filename)
+    Each file is claimed by atomically moving it into the inbox directory
+    of one of the workers. All files coming from the same producer end up
+    with the same worker, so that its counters are never updated by two
+    DB transactions at a time.
 
+    Inbox directories reside under `WORKERS_DIR` within watch directory,
+    files there are left alone by the dispatcher. Dead workers are
+    restarted.
+    """
+
+    def __init__(self, watch_dir, workers, method):
+        super(MetricsDispatcher, self).__init__()
+        self._method = method
+        self._workers_dir = os.path.join(watch_dir, WORKERS_DIR)
+        self._inboxes = [os.path.join(self._workers_dir, str(number))
+                         for number in range(workers)]
+        self._workers = [None] * workers
+        self._next_check = 0
+
+        for inbox in self._inboxes:
+            if not os.path.exists(inbox):
+                os.makedirs(inbox)
+
+        self.tick()
+
+        # re-dispatch files queued for workers we no longer have
+        for entry in os.listdir(self._workers_dir):
+            inbox = os.path.join(self._workers_dir, entry)
+            if inbox not in self._inboxes and os.path.isdir(inbox):
+                self._dispatch(_traverse_dir(inbox))
+
+    @property
+    def deadline(self):
+        """Time by which `tick` should be called."""
+        return min(
+            self._next_check, super(MetricsDispatcher, self).deadline)
+
+    def _dispatch(self, files):
+        for filename in files:
             try:
-                with open(filename) as fl:
-                    jsondoc = json.loads(fl.read())
+                producer = _peek_producer(filename)
+
+                number = (zlib.crc32(producer.encode('utf-8')) &
+                          0xffffffff) % len(self._inboxes)
+
+                # producers tend to reuse file names across subdirectories
+                claimed = os.path.join(
+                    self._inboxes[number], '%s-%s' % (
+                        uuid.uuid1().hex, os.path.basename(filename)))
+
+                os.rename(filename, claimed)
 
             except Exception as exc:
-                log.error('Error reading file %s: %s' % (filename, exc))
+                log.error('Error dispatching file %s: %s' % (filename, exc))
                 continue
 
-            finally:
-                os.unlink(filename)
+            log.debug('Dispatched %s to worker #%d' % (filename, number))
 
-            try:
-                manager.import_metrics(jsondoc)
+    def process(self, files):
+        self._dispatch(
+            filename for filename in files
+            if not filename.startswith(self._workers_dir + os.sep))
 
-            except Exception as exc:
-                log.error('Error processing file %s: %s' % (filename, exc))
+    def tick(self):
+        super(MetricsDispatcher, self).tick()
+
+        now = time.time()
+
+        if now < self._next_check:
+            return
+
+        for number, worker in enumerate(self._workers):
+            if worker and worker.is_alive():
                 continue
 
-        time.sleep(POLL_PERIOD)
+            if worker:
+                log.error('Importer worker #%d exited with status %s, '
+                          'restarting' % (number, worker.exitcode))
+
+            worker = multiprocessing.Process(
+                target=_run_worker,
+                args=(number, self._inboxes[number], self._method))
+
+            worker.daemon = True
+            worker.start()
+
+            log.info('Started importer worker #%d (PID %s) watching '
+                     '%s' % (number, worker.pid, self._inboxes[number]))
+
+            self._workers[number] = worker
+
+        self._next_check = now + WORKERS_CHECK_PERIOD
+
+    def stop(self):
+        for worker in self._workers:
+            if worker and worker.is_alive():
+                worker.terminate()
+                worker.join()
+
+
+def _poll_metrics(watch_dir, handler):
+    while True:
+
+        try:
+            files = _traverse_dir(watch_dir)
+
+        except Exception as exc:
+            log.error('Directory %s traversal failure: %s' % (watch_dir, exc))
+            time.sleep(10)
+            continue
+
+        handler.process(files)
+
+        handler.tick()
+
+        delay = POLL_PERIOD
+
+        if handler.deadline:
+            delay = max(0, min(delay, handler.deadline - time.time()))
+
+        time.sleep(delay)
+
+
+def _inotify_metrics(watch_dir, handler):
+    watcher = inotify.TreeWatcher(
+        watch_dir, inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO)
+
+    # pick up whatever has been there before we started watching
+    handler.process(_traverse_dir(watch_dir))
+
+    while True:
+        handler.tick()
+
+        timeout = None
+
+        if handler.deadline:
+            timeout = max(0, handler.deadline - time.time())
+
+        files = []
+
+        for path, mask in watcher.read_events(timeout):
+
+            # events might have been missed, rescan what is affected
+            if mask & (inotify.IN_Q_OVERFLOW | inotify.IN_ISDIR):
+                try:
+                    files.extend(_traverse_dir(path))
+
+                except Exception as exc:
+                    log.error(
+                        'Directory %s traversal failure: %s' % (path, exc))
+
+            else:
+                files.append(path)
+
+        handler.process(
+            [f for f in collections.OrderedDict.fromkeys(files)
+             if os.path.exists(f)])
+
+
+WATCH_METHODS = {
+    'poll': _poll_metrics,
+    'inotify': _inotify_metrics,
+}
+
+
+def watch_metrics(watch_dir, method='poll', workers=1):
+    """Import and remove metrics files as they appear in `watch_dir`.
+
+    The `poll` method rescans the whole directory tree every `POLL_PERIOD`
+    seconds. The `inotify` method reacts on files being written or moved
+    into the directory tree as soon as that happens. It is only available
+    on Linux.
+
+    With more than one worker, metrics files are distributed among
+    that many importer processes.
+    """
+    try:
+        watcher = WATCH_METHODS[method]
+
+    except KeyError:
+        raise error.ControlPlaneError(
+            'Unknown directory watch method %s' % method)
+
+    if workers < 1:
+        raise error.ControlPlaneError(
+            'Bad number of importer workers %s' % workers)
+
+    log.info('Watching directory %s using %s' % (watch_dir, method))
+
+    if workers == 1:
+        watcher(watch_dir, MetricsImporter())
+        return
+
+    dispatcher = MetricsDispatcher(watch_dir, workers, method)
+
+    try:
+        watcher(watch_dir, dispatcher)
+
+    finally:
+        dispatcher.stop()
@@ -0,0 +1,176 @@
+#
+# This file is part of SNMP simulator Control Plane software.
+#
+# Copyright (c) 2019-2020, Ilya Etingof <etingof@gmail.com>
+# License: http://snmplabs.com/snmpsim/license.html
+#
+# SNMP simulator metrics: stale metrics purging
+#
+import datetime
+import time
+
+from sqlalchemy import exists
+from sqlalchemy import select
+from sqlalchemy import text
+
+from snmpsim_control_plane import log
+from snmpsim_control_plane.metrics import app
+from snmpsim_control_plane.metrics import db
+from snmpsim_control_plane.metrics import models
+from snmpsim_control_plane.metrics import summaries
+
+# SQLite pages to give back to file system per run
+VACUUM_PAGES = 10000
+
+SQLITE_AUTO_VACUUM_INCREMENTAL = 2
+
+
+def _get_cutoff(option):
+    retention = app.config[option]
+    if retention is None:
+        return
+
+    return datetime.datetime.utcnow() - datetime.timedelta(seconds=retention)
+
+
+def _delete(model, condition):
+    db.session.query(model).filter(condition).delete(
+        synchronize_session=False)
+
+
+def _delete_transports(ids):
+    agent_ids = select(
+        [models.Agent.id]).where(models.Agent.transport_id.in_(ids))
+
+    recording_ids = select(
+        [models.Recording.id]).where(
+        models.Recording.agent_id.in_(agent_ids))
+
+    pdu_ids = select(
+        [models.Pdu.id]).where(models.Pdu.recording_id.in_(recording_ids))
+
+    _delete(models.Variation, models.Variation.pdu_id.in_(pdu_ids))
+    _delete(models.VarBind, models.VarBind.pdu_id.in_(pdu_ids))
+    _delete(models.MessageSeries, models.MessageSeries.pdu_id.in_(pdu_ids))
+    _delete(models.Pdu, models.Pdu.recording_id.in_(recording_ids))
+    _delete(models.Recording, models.Recording.agent_id.in_(agent_ids))
+    _delete(models.Agent, models.Agent.transport_id.in_(ids))
+    _delete(models.PacketSeries, models.PacketSeries.transport_id.in_(ids))
+    _delete(models.Packet, models.Packet.transport_id.in_(ids))
+    _delete(models.Transport, models.Transport.id.in_(ids))
+
+
+def _delete_processes(ids):
+    _delete(models.Endpoint, models.Endpoint.process_id.in_(ids))
+    _delete(models.ConsolePage, models.ConsolePage.process_id.in_(ids))
+    _delete(models.Process, models.Process.id.in_(ids))
+
+
+def _delete_supervisors(ids):
+    _delete(models.Supervisor, models.Supervisor.id.in_(ids))
+
+
+def _delete_console_pages(ids):
+    _delete(models.ConsolePage, models.ConsolePage.id.in_(ids))
+
+
+def _purge(query, delete):
+    """Delete rows `query` yields IDs of, in batches.
+
+    Each batch is committed on its own, so that DB locks are only
+    held for a short while.
+
+    Returns the number of rows removed.
+    """
+    batch_size = app.config['SNMPSIM_METRICS_RETENTION_BATCH_SIZE']
+
+    purged = 0
+
+    while True:
+        ids = [row[0] for row in query.limit(batch_size).all()]
+        if not ids:
+            return purged
+
+        delete(ids)
+
+        db.session.commit()
+
+        purged += len(ids)
+
+
+def _compact():
+    if db.engine.dialect.name != 'sqlite':
+        return
+
+    auto_vacuum = db.session.execute(text('PRAGMA auto_vacuum')).scalar()
+
+    if auto_vacuum == SQLITE_AUTO_VACUUM_INCREMENTAL:
+        # Python's sqlite3 `execute` makes just one pragma step which
+        # frees just one page, while `executescript` runs it through
+        db.session.connection().connection.executescript(
+            'PRAGMA incremental_vacuum(%d);' % VACUUM_PAGES)
+
+    db.session.execute(text('ANALYZE'))
+
+    db.session.commit()
+
+
+def purge_metrics():
+    """Remove metrics not updated within their retention periods.
+
+    Stale transports are removed along with all their counters and
+    series, stale processes along with their endpoints and console
+    pages. Supervisors are removed once they have no processes left
+    and have not reported for as long as processes are retained.
+    Console pages are removed once they get older than console
+    retention period.
+
+    Afterwards, SQLite DB gives freed pages back to the file system
+    (if incremental vacuum is enabled) and query planner statistics
+    are refreshed.
+
+    Returns a dict of the numbers of removed rows.
+    """
+    started = time.time()
+
+    report = {}
+
+    cutoff = _get_cutoff('SNMPSIM_METRICS_TRANSPORT_RETENTION')
+    if cutoff:
+        report['transports'] = _purge(
+            db.session.query(models.Transport.id)
+            .filter(models.Transport.last_update < cutoff),
+            _delete_transports)
+
+        if report['transports']:
+            summaries.rebuild()
+
+    cutoff = _get_cutoff('SNMPSIM_METRICS_PROCESS_RETENTION')
+    if cutoff:
+        report['processes'] = _purge(
+            db.session.query(models.Process.id)
+            .filter(models.Process.last_update < cutoff),
+            _delete_processes)
+
+        report['supervisors'] = _purge(
+            db.session.query(models.Supervisor.id)
+            .filter(models.Supervisor.last_update < cutoff)
+            .filter(~exists().where(
+                models.Process.supervisor_id == models.Supervisor.id)),
+            _delete_supervisors)
+
+    cutoff = _get_cutoff('SNMPSIM_METRICS_CONSOLE_RETENTION')
+    if cutoff:
+        report['console_pages'] = _purge(
+            db.session.query(models.ConsolePage.id)
+            .filter(models.ConsolePage.timestamp < cutoff),
+            _delete_console_pages)
+
+    _compact()
+
+    log.info('Purged stale metrics in %.2f sec: %s' % (
+        time.time() - started, ', '.join(
+            '%d %s' % (report[name], name.replace('_', ' '))
+            for name in sorted(report)) or 'nothing to purge'))
+
+    return report
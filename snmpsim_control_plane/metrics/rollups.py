@@ -0,0 +1,226 @@
+#
+# This file is part of SNMP simulator Control Plane software.
+#
+# Copyright (c) 2019-2020, Ilya Etingof <etingof@gmail.com>
+# License: http://snmplabs.com/snmpsim/license.html
+#
+# SNMP simulator metrics: time series rollups
+#
+import time
+
+from sqlalchemy import select
+from sqlalchemy import text
+
+from snmpsim_control_plane import error
+from snmpsim_control_plane.metrics import app
+from snmpsim_control_plane.metrics import db
+from snmpsim_control_plane.metrics import models
+
+PACKET_SERIES_COUNTERS = (
+    'total', 'parse_failures', 'auth_failures', 'context_failures'
+)
+
+MESSAGE_SERIES_COUNTERS = (
+    'pdus', 'var_binds', 'failures'
+)
+
+SERIES = (
+    (models.PacketSeries, 'transport_id', PACKET_SERIES_COUNTERS),
+    (models.MessageSeries, 'pdu_id', MESSAGE_SERIES_COUNTERS),
+)
+
+
+def get_resolutions():
+    """Return configured `(resolution, retention)` pairs, finest first.
+
+    Each resolution must be a multiple of the finer one, as it is built
+    by downsampling that one.
+    """
+    resolutions = sorted(
+        app.config['SNMPSIM_METRICS_SERIES_RESOLUTIONS'] or ())
+
+    for (fine, _), (coarse, _) in zip(resolutions, resolutions[1:]):
+        if coarse % fine:
+            raise error.ControlPlaneError(
+                'Series resolution %s is not a multiple of finer '
+                'resolution %s' % (coarse, fine))
+
+    return resolutions
+
+
+def get_timestamp(report):
+    """Return the time `report` counters should be attributed to.
+
+    Reports are attributed to the moment they end at. Returns `None`
+    if series are not configured.
+    """
+    if not get_resolutions():
+        return
+
+    return int(
+        report.get('last_update') or report.get('first_update') or
+        time.time())
+
+
+def get_interval(timestamp, now=None):
+    """Return `(resolution, start)` of the series interval to record into.
+
+    That is the finest resolution still retaining intervals as old as
+    `timestamp`, so that belated reports are not lost.
+    """
+    if now is None:
+        now = time.time()
+
+    resolutions = get_resolutions()
+
+    for resolution, retention in resolutions:
+        if timestamp >= now - retention:
+            break
+
+    else:
+        resolution = resolutions[-1][0]
+
+    return resolution, timestamp // resolution * resolution
+
+
+def choose_resolution(step, since, now=None):
+    """Pick the coarsest series resolution to serve `step`-long intervals.
+
+    Resolutions still holding data as old as `since` are preferred.
+    """
+    if now is None:
+        now = time.time()
+
+    resolutions = get_resolutions()
+    if not resolutions:
+        raise error.ControlPlaneError('Metrics series are not configured')
+
+    candidates = [(resolution, retention)
+                  for resolution, retention in resolutions
+                  if not step % resolution]
+    if not candidates:
+        raise error.ControlPlaneError(
+            'Series step must be a multiple of %s '
+            'seconds' % resolutions[0][0])
+
+    covering = [resolution for resolution, retention in candidates
+                if since >= now - retention]
+    if covering:
+        return max(covering)
+
+    return max(candidates, key=lambda x: x[1])[0]
+
+
+def _quote(name):
+    return db.engine.dialect.identifier_preparer.quote(name)
+
+
+def mark_dirty(since, resolution=None):
+    """Note that series intervals starting from `since` have changed.
+
+    Coarser resolution intervals built from them should be rebuilt. Unless
+    `resolution` is given, the finest one is assumed to be changed.
+    """
+    resolutions = [r for r, _ in get_resolutions()]
+
+    if resolution is None:
+        resolution = resolutions and resolutions[0]
+
+    coarser = [r for r in resolutions if r > resolution]
+    if not coarser:
+        return
+
+    table = _quote(models.SeriesRollup.__table__.name)
+    column = _quote('dirty_since')
+
+    statement = text(
+        'INSERT INTO %(table)s (resolution, %(column)s) '
+        'VALUES (:resolution, :since) '
+        'ON CONFLICT (resolution) DO UPDATE SET %(column)s = CASE '
+        'WHEN %(table)s.%(column)s IS NULL OR '
+        '%(table)s.%(column)s > excluded.%(column)s '
+        'THEN excluded.%(column)s ELSE %(table)s.%(column)s END' % {
+            'table': table, 'column': column})
+
+    db.session.execute(
+        statement, {'resolution': min(coarser), 'since': since})
+
+
+def _downsample(fine, fine_retention, coarse, now):
+    table = models.SeriesRollup.__table__
+
+    # serialize against importers marking this resolution dirty
+    result = db.session.execute(
+        table.update()
+        .where(table.c.resolution == coarse)
+        .values(dirty_since=table.c.dirty_since))
+
+    if not result.rowcount:
+        return
+
+    dirty_since = db.session.execute(
+        select([table.c.dirty_since])
+        .where(table.c.resolution == coarse)).scalar()
+
+    if dirty_since is None:
+        return
+
+    # do not rebuild intervals finer series are already partially gone for
+    oldest = (now - fine_retention + coarse - 1) // coarse * coarse
+
+    since = max(dirty_since // coarse * coarse, oldest)
+
+    for model, id_column, counters in SERIES:
+        statement = text(
+            'INSERT INTO %(table)s (resolution, %(ts)s, %(id)s, '
+            '%(counters)s) SELECT %(coarse)d, '
+            '%(ts)s - %(ts)s %% %(coarse)d, %(id)s, %(sums)s '
+            'FROM %(table)s WHERE resolution = %(fine)d '
+            'AND %(ts)s >= :since GROUP BY 2, 3 '
+            'ON CONFLICT (resolution, %(ts)s, %(id)s) '
+            'DO UPDATE SET %(updates)s' % {
+                'table': _quote(model.__table__.name),
+                'ts': _quote('timestamp'),
+                'id': _quote(id_column),
+                'counters': ', '.join(_quote(c) for c in counters),
+                'sums': ', '.join('sum(%s)' % _quote(c) for c in counters),
+                'updates': ', '.join(
+                    '%s = excluded.%s' % (_quote(c), _quote(c))
+                    for c in counters),
+                'coarse': coarse,
+                'fine': fine})
+
+        db.session.execute(statement, {'since': since})
+
+    db.session.execute(
+        table.update()
+        .where(table.c.resolution == coarse)
+        .values(dirty_since=None))
+
+    mark_dirty(since, coarse)
+
+
+def update_rollups(now=None):
+    """Downsample time series and drop expired intervals.
+
+    Each coarser resolution is rebuilt from the next finer one, but only
+    for the intervals that have changed since the last run. Intervals
+    older than the retention period of their resolution are removed.
+    """
+    if now is None:
+        now = int(time.time())
+
+    resolutions = get_resolutions()
+
+    for (fine, fine_retention), (coarse, _) in zip(
+            resolutions, resolutions[1:]):
+        _downsample(fine, fine_retention, coarse, now)
+
+    for resolution, retention in resolutions:
+        for model, _, _ in SERIES:
+            db.session.query(model).filter(
+                model.resolution == resolution,
+                model.timestamp < now - retention
+            ).delete(synchronize_session=False)
+
+    db.session.commit()
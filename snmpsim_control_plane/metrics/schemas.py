@@ -24,12 +24,12 @@ class PacketsSchema(marshmallow.Schema, EnsureZeroMixIn):
     class Meta:
         fields = (
             'total', 'parse_failures', 'auth_failures',
-            'context_failures')
+            'context_failures', 'total_rate')
 
 
 class MessagesSchema(marshmallow.Schema, EnsureZeroMixIn):
     class Meta:
-        fields = ('pdus', 'var_binds', 'failures', 'variations')
+        fields = ('pdus', 'var_binds', 'failures', 'pdus_rate', 'variations')
 
     variations = marshmallow.fields.Dict()
 
@@ -44,6 +44,8 @@ class ConsoleSchema(ma.ModelSchema):
         model = models.ConsolePage
         fields = ('id', 'timestamp', 'text', 'process', '_links')
 
+    text = marshmallow.fields.String()
+
     class ProcessSchema(ma.ModelSchema):
         class Meta:
             model = models.Process
@@ -89,7 +91,8 @@ class ProcessSchema(ma.ModelSchema):
         model = models.Process
         fields = ('id', 'path', 'runtime', 'memory', 'cpu', 'files',
                   'exits', 'changes', 'last_update', 'update_interval',
-                  'endpoints', 'supervisor', 'console_pages', '_links')
+                  'cpu_rate', 'exits_rate', 'swap_latency', 'endpoints',
+                  'supervisor', 'console_pages', '_links')
 
     class EndpointsSchema(ma.ModelSchema):
         class Meta:
@@ -0,0 +1,224 @@
+#
+# This file is part of SNMP simulator Control Plane software.
+#
+# Copyright (c) 2019-2020, Ilya Etingof <etingof@gmail.com>
+# License: http://snmplabs.com/snmpsim/license.html
+#
+# SNMP simulator metrics: materialized activity summaries
+#
+from sqlalchemy import String
+from sqlalchemy import cast
+from sqlalchemy import func
+from sqlalchemy import literal
+from sqlalchemy import select
+
+from snmpsim_control_plane import log
+from snmpsim_control_plane.metrics import db
+from snmpsim_control_plane.metrics import models
+
+# `Term` table aliases by term kind
+TERMS = dict(
+    (kind, models.Term.__table__.alias('%s_term' % kind))
+    for kind in (models.ENGINE_TERM, models.CONTEXT_ENGINE_TERM,
+                 models.CONTEXT_NAME_TERM, models.RECORDING_TERM,
+                 models.PDU_TYPE_TERM, models.VARIATION_TERM))
+
+# Search dimensions in the order of `MetricsBatch` key elements
+PACKET_DIMENSIONS = (
+    ('protocol', models.Transport.transport_protocol),
+    ('local_address', models.Transport.endpoint),
+    ('peer_address', models.Transport.peer),
+)
+
+MESSAGE_DIMENSIONS = PACKET_DIMENSIONS + (
+    ('engine_id', TERMS[models.ENGINE_TERM].c.value),
+    ('security_model', models.Agent.security_model),
+    ('security_level', models.Agent.security_level),
+    ('context_engine_id', TERMS[models.CONTEXT_ENGINE_TERM].c.value),
+    ('context_name', TERMS[models.CONTEXT_NAME_TERM].c.value),
+    ('recording', TERMS[models.RECORDING_TERM].c.value),
+    ('pdu_type', TERMS[models.PDU_TYPE_TERM].c.value),
+)
+
+PACKET_SUMMARY_COUNTERS = (
+    'total', 'parse_failures', 'auth_failures', 'context_failures'
+)
+
+MESSAGE_SUMMARY_COUNTERS = (
+    'pdus', 'var_binds', 'failures'
+)
+
+VARIATION_SUMMARY_COUNTERS = (
+    'total', 'failures'
+)
+
+# Grand totals live under this dimension
+TOTAL = ''
+
+
+def _add(rows, key, counters):
+    row = rows.get(key)
+    if row is None:
+        rows[key] = list(counters)
+
+    else:
+        for idx, counter in enumerate(counters):
+            row[idx] += counter
+
+
+def summarize(batch):
+    """Sum up `MetricsBatch` counters by search dimension values.
+
+    Returns packets, messages and variations summaries as dicts
+    mapping `(dimension, value)` (followed by variation module name
+    for variations) onto counters.
+    """
+    packets = {}
+    messages = {}
+    variations = {}
+
+    for rows, metrics, dimensions in (
+            (packets, batch.packets, PACKET_DIMENSIONS),
+            (messages, batch.messages, MESSAGE_DIMENSIONS)):
+
+        for key, counters in metrics.items():
+            _add(rows, (TOTAL, TOTAL), counters)
+
+            for idx, (dimension, _) in enumerate(dimensions):
+                _add(rows, (dimension, '%s' % (key[idx],)), counters)
+
+    for key, counters in batch.variations.items():
+        name = key[-1]
+
+        _add(variations, (TOTAL, TOTAL, name), counters)
+
+        for idx, (dimension, _) in enumerate(MESSAGE_DIMENSIONS):
+            _add(variations, (dimension, '%s' % (key[idx],), name), counters)
+
+    return packets, messages, variations
+
+
+def import_summaries_by_node(batch):
+    """Add up `MetricsBatch` counters to summaries row by row."""
+    packets, messages, variations = summarize(batch)
+
+    for model, columns, counter_columns, rows in (
+            (models.PacketSummary, ('dimension', 'value'),
+             PACKET_SUMMARY_COUNTERS, packets),
+            (models.MessageSummary, ('dimension', 'value'),
+             MESSAGE_SUMMARY_COUNTERS, messages),
+            (models.VariationSummary, ('dimension', 'value', 'name'),
+             VARIATION_SUMMARY_COUNTERS, variations)):
+
+        for key, counters in rows.items():
+            summary_mdl = db.session.merge(model(**dict(zip(columns, key))))
+
+            for column, counter in zip(counter_columns, counters):
+                setattr(summary_mdl, column,
+                        (getattr(summary_mdl, column) or 0) + counter)
+
+    db.session.commit()
+
+
+def _rebuild(model, counter_columns, sums, joins, dimensions, group_by=()):
+    table = model.__table__
+
+    columns = ['dimension', 'value'] + [name for name, _ in group_by]
+    columns.extend(counter_columns)
+
+    group_by = [column for _, column in group_by]
+
+    for dimension, column in ((TOTAL, None),) + dimensions:
+        if column is None:
+            value = literal(TOTAL)
+
+        else:
+            value = cast(column, String)
+
+        query = (
+            select([literal(dimension), value] + list(group_by) + sums)
+            .select_from(joins))
+
+        group = list(group_by)
+        if column is not None:
+            group.insert(0, column)
+
+        if group:
+            query = query.group_by(*group)
+
+        db.session.execute(table.insert().from_select(columns, query))
+
+
+def join_packets():
+    """Join metrics tables `PACKET_DIMENSIONS` columns belong to."""
+    transport = models.Transport.__table__
+    packet = models.Packet.__table__
+
+    return packet.join(transport, transport.c.id == packet.c.transport_id)
+
+
+def join_pdus():
+    """Join metrics tables `MESSAGE_DIMENSIONS` columns belong to."""
+    transport = models.Transport.__table__
+    agent = models.Agent.__table__
+    recording = models.Recording.__table__
+    pdu = models.Pdu.__table__
+
+    pdu_joins = (
+        pdu
+        .join(recording, recording.c.id == pdu.c.recording_id)
+        .join(agent, agent.c.id == recording.c.agent_id)
+        .join(transport, transport.c.id == agent.c.transport_id))
+
+    for kind, column in (
+            (models.ENGINE_TERM, agent.c.engine_id),
+            (models.CONTEXT_ENGINE_TERM, agent.c.context_engine_id),
+            (models.CONTEXT_NAME_TERM, agent.c.context_name_id),
+            (models.RECORDING_TERM, recording.c.path_id),
+            (models.PDU_TYPE_TERM, pdu.c.name_id)):
+        term = TERMS[kind]
+        pdu_joins = pdu_joins.join(term, term.c.id == column)
+
+    return pdu_joins
+
+
+def rebuild():
+    """Recalculate all summaries from metrics DB tables."""
+    log.info('Rebuilding metrics summaries')
+
+    for model in (models.PacketSummary, models.MessageSummary,
+                  models.VariationSummary):
+        db.session.query(model).delete(synchronize_session=False)
+
+    pdu = models.Pdu.__table__
+    packet = models.Packet.__table__
+    varbind = models.VarBind.__table__
+    variation = models.Variation.__table__
+
+    _rebuild(
+        models.PacketSummary, PACKET_SUMMARY_COUNTERS,
+        [func.sum(packet.c.total), func.sum(packet.c.parse_failures),
+         func.sum(packet.c.auth_failures),
+         func.sum(packet.c.context_failures)],
+        join_packets(), PACKET_DIMENSIONS)
+
+    pdu_joins = join_pdus()
+
+    variation_term = TERMS[models.VARIATION_TERM]
+
+    _rebuild(
+        models.MessageSummary, MESSAGE_SUMMARY_COUNTERS,
+        [func.sum(pdu.c.total), func.sum(varbind.c.total),
+         func.sum(varbind.c.failures)],
+        pdu_joins.join(varbind, varbind.c.pdu_id == pdu.c.id),
+        MESSAGE_DIMENSIONS)
+
+    _rebuild(
+        models.VariationSummary, VARIATION_SUMMARY_COUNTERS,
+        [func.sum(variation.c.total), func.sum(variation.c.failures)],
+        pdu_joins
+        .join(variation, variation.c.pdu_id == pdu.c.id)
+        .join(variation_term, variation_term.c.id == variation.c.name_id),
+        MESSAGE_DIMENSIONS, group_by=(('name', variation_term.c.value),))
+
+    db.session.commit()
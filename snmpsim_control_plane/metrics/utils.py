@@ -6,22 +6,123 @@
 #
 # SNMP simulator metrics: snmpsim metrics helpers
 #
+import collections
+
 from sqlalchemy import func
+from sqlalchemy import select
 
 from snmpsim_control_plane.metrics import db
+from snmpsim_control_plane.metrics import models
 
 
-def autoincrement(obj, model):
-    """Add unique ID to model.
+class LruCache(object):
+    """Size-bounded mapping evicting least recently used entries."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._entries.pop(key)
+
+        except KeyError:
+            return default
+
+        self._entries[key] = value
+
+        return value
+
+    def __setitem__(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = value
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class IdAllocator(object):
+    """Process-local row ID allocator.
 
     Sqlalchemy's merge requires unique fields being primary keys. On top of
-    that, autoincrement does not always work with Sqlalchemy. Thus this
-    hack to generate unique row ID. %-(
+    that, autoincrement does not always work with Sqlalchemy. Thus row IDs
+    are generated by the application.
+
+    IDs are reserved in blocks, per model, by bumping the `next_id` counter
+    kept in the `id_allocation` table, then handed out from memory. The
+    reservation runs within the caller's transaction, so concurrent importers
+    get serialized on the allocation row, while failed imports give their
+    block back on rollback. That is also why reserved IDs must be forgotten
+    whenever the session gets rolled back.
     """
-    if obj.id is None:
-        max_id = db.session.query(func.max(model.id)).first()
-        max_id = max_id[0]
-        max_id = max_id + 1 if max_id else 1
-        obj.id = max_id
 
-        db.session.commit()
+    BLOCK_SIZE = 128
+
+    def __init__(self, block_size=BLOCK_SIZE):
+        self._block_size = block_size
+        self._blocks = {}
+
+    def _reserve(self, model, size):
+        table = models.IdAllocation.__table__
+        name = model.__table__.name
+
+        result = db.session.execute(
+            table.update()
+            .where(table.c.model == name)
+            .values(next_id=table.c.next_id + size))
+
+        if result.rowcount:
+            next_id = db.session.execute(
+                select([table.c.next_id])
+                .where(table.c.model == name)).scalar()
+
+            return next_id - size, next_id
+
+        # first reservation ever, continue from whatever is in the DB
+
+        max_id = db.session.query(func.max(model.id)).scalar() or 0
+
+        db.session.execute(
+            table.insert().values(model=name, next_id=max_id + 1 + size))
+
+        return max_id + 1, max_id + 1 + size
+
+    def allocate(self, model, count=1):
+        """Return a list of `count` unused row IDs for `model`."""
+        name = model.__table__.name
+
+        ids = []
+
+        while len(ids) < count:
+            next_id, end_id = self._blocks.get(name, (0, 0))
+
+            if next_id >= end_id:
+                next_id, end_id = self._reserve(
+                    model, max(count - len(ids), self._block_size))
+
+            taken = min(end_id - next_id, count - len(ids))
+
+            ids.extend(range(next_id, next_id + taken))
+
+            self._blocks[name] = next_id + taken, end_id
+
+        return ids
+
+    def reset(self):
+        """Forget all reserved IDs."""
+        self._blocks.clear()
+
+
+ID_ALLOCATOR = IdAllocator()
+
+
+def autoincrement(obj, model):
+    """Add unique ID to model."""
+    if obj.id is None:
+        obj.id = ID_ALLOCATOR.allocate(model)[0]
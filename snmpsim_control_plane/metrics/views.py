@@ -6,13 +6,28 @@
 #
 # SNMP simulator metrics: REST API views
 #
+import base64
+import datetime
+import json
+import time
+
 import flask
 from werkzeug import exceptions
+from sqlalchemy import DateTime
 from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy import tuple_
 
+from snmpsim_control_plane import error
 from snmpsim_control_plane.metrics import app
+from snmpsim_control_plane.metrics import cache
+from snmpsim_control_plane.metrics import db
+from snmpsim_control_plane.metrics import generation
 from snmpsim_control_plane.metrics import models
+from snmpsim_control_plane.metrics import prometheus
+from snmpsim_control_plane.metrics import rollups
 from snmpsim_control_plane.metrics import schemas
+from snmpsim_control_plane.metrics import summaries
 
 PREFIX = '/snmpsim/metrics/v1'
 
@@ -41,6 +56,74 @@ def all_exception_handler(exc):
     return response
 
 
+UNCACHEABLE_QS_PARAMS = ('wait',)
+
+
+def _get_cache_key():
+    query = json.dumps(sorted(flask.request.args.items(multi=True)))
+
+    return '%s?%s' % (flask.request.path, query)
+
+
+@app.before_request
+def serve_from_cache():
+    """Answer from cache unless metrics DB has changed.
+
+    Response ETag is derived from metrics DB generation, so that
+    polling clients get `304 Not Modified` without touching the DB.
+    """
+    if flask.request.method not in ('GET', 'HEAD'):
+        return
+
+    # long-polling clients want to wait for the next generation
+    if any(param in flask.request.args for param in UNCACHEABLE_QS_PARAMS):
+        return
+
+    try:
+        current = generation.get_generation()
+
+    except error.ControlPlaneError as exc:
+        app.logger.error(exc)
+        return
+
+    if current is None:
+        return
+
+    flask.g.generation = etag = '%x-%x' % current
+
+    if etag in flask.request.if_none_match:
+        response = flask.Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    flask.g.cache_key = _get_cache_key()
+
+    cached = cache.get_response(flask.g.cache_key, etag)
+    if cached:
+        status, mimetype, body = cached
+        response = flask.Response(bytes(body), status, mimetype=mimetype)
+        response.set_etag(etag)
+        return response
+
+
+@app.after_request
+def update_cache(response):
+    etag = flask.g.pop('generation', None)
+    cache_key = flask.g.pop('cache_key', None)
+
+    if etag is None or response.status_code != 200:
+        return response
+
+    response.set_etag(etag)
+
+    if cache_key is not None:
+        cache.put_response(
+            cache_key, etag, response.status_code, response.mimetype,
+            response.get_data())
+
+    return response
+
+
 PACKETS_QS_COLUMN_MAP = {
     'protocol': models.Transport.transport_protocol,
     'local_address': models.Transport.endpoint,
@@ -48,32 +131,89 @@ PACKETS_QS_COLUMN_MAP = {
 }
 
 MESSAGES_QS_COLUMN_MAP = {
-    'engine_id': models.Agent.engine,
+    'engine_id': models.Agent.engine_id,
     'security_model': models.Agent.security_model,
     'security_level': models.Agent.security_level,
-    'context_engine_id': models.Agent.context_engine,
-    'context_name': models.Agent.context_name,
-    'pdu_type': models.Pdu.name,
-    'recording': models.Recording.path,
+    'context_engine_id': models.Agent.context_engine_id,
+    'context_name': models.Agent.context_name_id,
+    'pdu_type': models.Pdu.name_id,
+    'recording': models.Recording.path_id,
 }
 
 QS_COLUMN_MAP = PACKETS_QS_COLUMN_MAP.copy()
 QS_COLUMN_MAP.update(MESSAGES_QS_COLUMN_MAP)
 
+# Search terms referring to `Term` values
+QS_TERM_MAP = {
+    'engine_id': models.ENGINE_TERM,
+    'context_engine_id': models.CONTEXT_ENGINE_TERM,
+    'context_name': models.CONTEXT_NAME_TERM,
+    'pdu_type': models.PDU_TYPE_TERM,
+    'recording': models.RECORDING_TERM,
+}
+
+SERIES_QS_PARAMS = ('step', 'from', 'to')
 
-def filter_by(query, *fields):
+TOP_QS_PARAMS = ('by', 'metric', 'n')
+
+DEFAULT_TOP_SIZE = 10
+
+# Variation modules are ranked by their own counters
+TOP_VARIATION = 'variation'
+
+# metric: (summary model, counter)
+TOP_METRICS = {
+    'packets': (models.PacketSummary, 'total'),
+    'pdus': (models.MessageSummary, 'pdus'),
+    'var_binds': (models.MessageSummary, 'var_binds'),
+    'failures': (models.MessageSummary, 'failures'),
+}
+
+TOP_VARIATION_METRICS = {
+    'calls': 'total',
+    'failures': 'failures',
+}
+
+DEFAULT_SERIES_SPAN = 86400
+
+MAX_SERIES_POINTS = 1440
+
+PAGINATION_QS_PARAMS = ('limit', 'cursor')
+
+TIMESTAMP_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+MAX_CONSOLE_WAIT = 60
+
+CONSOLE_POLL_PERIOD = 1
+
+
+def check_search_terms(*fields, **kwargs):
     search_columns = flask.request.args
 
-    unknown_columns = set(search_columns).difference(fields)
+    unknown_columns = set(search_columns).difference(
+        fields, kwargs.get('params', ()))
     if unknown_columns:
         raise exceptions.NotFound(
             'Search term(s) %s not supported' % ', '.join(unknown_columns))
 
+
+def filter_by(query, *fields, **kwargs):
+    search_columns = flask.request.args
+
+    check_search_terms(*fields, **kwargs)
+
     for field in fields:
         args = search_columns.getlist(field)
-        if args:
-            query = query.filter(
-                QS_COLUMN_MAP[field].in_(args))
+        if not args:
+            continue
+
+        if field in QS_TERM_MAP:
+            args = (
+                select([models.Term.id])
+                .where(models.Term.kind == QS_TERM_MAP[field])
+                .where(models.Term.value.in_(args)))
+
+        query = query.filter(QS_COLUMN_MAP[field].in_(args))
 
     return query
 
@@ -89,7 +229,8 @@ def show_root():
 def show_activity():
     return {
         'packets': flask.url_for('show_packets'),
-        'messages': flask.url_for('show_messages')
+        'messages': flask.url_for('show_messages'),
+        'top': flask.url_for('show_top')
     }
 
 
@@ -124,6 +265,17 @@ def show_filter(target, flt):
     except KeyError:
         raise exceptions.NotFound('No such filter')
 
+    if flt in QS_TERM_MAP:
+        metrics = (
+            models.Term
+            .query
+            .with_entities(models.Term.value)
+            .filter(models.Term.kind == QS_TERM_MAP[flt])
+            .order_by(models.Term.value)
+            .all())
+
+        return flask.jsonify([mtr[0] for mtr in metrics])
+
     metrics = (
         models.Transport
         .query
@@ -134,8 +286,38 @@ def show_filter(target, flt):
     return flask.jsonify([mtr[0] for mtr in metrics])
 
 
-def _show_packets_or_messages(show_messages=False):
-    transport_query = (
+def _get_summary_filter(*fields):
+    """Tell which summary can answer the query.
+
+    Summaries are only kept by the value of a single search dimension,
+    queries filtering on more than one dimension should be answered by
+    joining the metrics tables.
+
+    Returns `(dimension, values)` tuple or `None`.
+    """
+    check_search_terms(*fields)
+
+    search_terms = [
+        (field, flask.request.args.getlist(field)) for field in fields
+        if flask.request.args.getlist(field)]
+
+    if not search_terms:
+        return summaries.TOTAL, [summaries.TOTAL]
+
+    if len(search_terms) == 1:
+        return search_terms[0]
+
+
+def _query_summary(model, dimension, values):
+    return (
+        model
+        .query
+        .filter(model.dimension == dimension)
+        .filter(model.value.in_(values)))
+
+
+def _query_transports():
+    return (
         models.Transport
         .query
         .with_entities(
@@ -143,41 +325,87 @@ def _show_packets_or_messages(show_messages=False):
             func.sum(models.Packet.parse_failures).label("parse_failures"),
             func.sum(models.Packet.auth_failures).label("auth_failures"),
             func.sum(models.Packet.context_failures).label(
-                "context_failures")))
+                "context_failures"),
+            func.sum(models.Packet.rate).label("total_rate")))
+
+
+def query_packets():
+    """Build packets query joining metrics tables by search terms."""
+    return filter_by(
+        _query_transports().join(models.Transport), *PACKETS_QS_COLUMN_MAP)
+
+
+def query_messages():
+    """Build messages and variations queries joining metrics tables
+    by search terms.
+
+    Returns `(messages, variations)` queries tuple.
+    """
+    agent_query = (
+        _query_transports()
+        .join(models.Transport)
+        .join(models.Agent)
+        .join(models.Recording)
+        .join(models.Pdu))
+
+    agent_query = filter_by(agent_query, *QS_COLUMN_MAP)
 
+    messages_query = (
+        agent_query
+        .join(models.VarBind)
+        .with_entities(
+            func.sum(models.Pdu.total).label("pdus"),
+            func.sum(models.VarBind.total).label("var_binds"),
+            func.sum(models.VarBind.failures).label("failures"),
+            func.sum(models.Pdu.rate).label("pdus_rate")))
+
+    variations_query = (
+        agent_query
+        .join(models.Variation)
+        .join(models.Term, models.Term.id == models.Variation.name_id)
+        .with_entities(
+            models.Term.value.label("name"),
+            func.sum(models.Variation.total).label("total"),
+            func.sum(models.Variation.failures).label("failures"))
+        .group_by(models.Term.value))
+
+    return messages_query, variations_query
+
+
+def _show_packets_or_messages(show_messages=False):
     # We have to build JSON response by hand because here it's a mix of
     # ORM models and custom dicts. Marshmallow does not seem to be well-suited
     # for handling that.
     metrics = {}
 
     if show_messages:
-        agent_query = (
-            transport_query
-            .join(models.Transport)
-            .join(models.Agent)
-            .join(models.Recording)
-            .join(models.Pdu))
-
-        agent_query = filter_by(agent_query, *QS_COLUMN_MAP)
-
-        var_binds_query = (
-            agent_query
-            .join(models.VarBind)
-            .with_entities(
-                func.sum(models.Pdu.total).label("pdus"),
-                func.sum(models.VarBind.total).label("var_binds"),
-                func.sum(models.VarBind.failures).label("failures")))
-
-        variations_query = (
-            agent_query
-            .join(models.Variation)
-            .with_entities(
-                models.Variation.name,
-                func.sum(models.Variation.total).label("total"),
-                func.sum(models.Variation.failures).label("failures"))
-            .group_by(models.Variation.name))
-
-        messages = var_binds_query.first()
+        summary_filter = _get_summary_filter(*QS_COLUMN_MAP)
+
+        if summary_filter:
+            messages_query = (
+                _query_summary(models.MessageSummary, *summary_filter)
+                .with_entities(
+                    func.sum(models.MessageSummary.pdus).label("pdus"),
+                    func.sum(models.MessageSummary.var_binds).label(
+                        "var_binds"),
+                    func.sum(models.MessageSummary.failures).label(
+                        "failures"),
+                    func.sum(models.MessageSummary.rate).label(
+                        "pdus_rate")))
+
+            variations_query = (
+                _query_summary(models.VariationSummary, *summary_filter)
+                .with_entities(
+                    models.VariationSummary.name,
+                    func.sum(models.VariationSummary.total).label("total"),
+                    func.sum(models.VariationSummary.failures).label(
+                        "failures"))
+                .group_by(models.VariationSummary.name))
+
+        else:
+            messages_query, variations_query = query_messages()
+
+        messages = messages_query.first()
         schema = schemas.MessagesSchema()
         messages = schema.dump(messages).data
 
@@ -204,9 +432,26 @@ def _show_packets_or_messages(show_messages=False):
             variations=variations, _links=links, filters=filters, **messages)
 
     else:
-        transport_query = filter_by(transport_query, *PACKETS_QS_COLUMN_MAP)
-
-        packets = transport_query.first()
+        summary_filter = _get_summary_filter(*PACKETS_QS_COLUMN_MAP)
+
+        if summary_filter:
+            packets_query = (
+                _query_summary(models.PacketSummary, *summary_filter)
+                .with_entities(
+                    func.sum(models.PacketSummary.total).label("total"),
+                    func.sum(models.PacketSummary.parse_failures).label(
+                        "parse_failures"),
+                    func.sum(models.PacketSummary.auth_failures).label(
+                        "auth_failures"),
+                    func.sum(models.PacketSummary.context_failures).label(
+                        "context_failures"),
+                    func.sum(models.PacketSummary.rate).label(
+                        "total_rate")))
+
+        else:
+            packets_query = query_packets()
+
+        packets = packets_query.first()
         schema = schemas.PacketsSchema()
         packets = schema.dump(packets).data
 
@@ -240,15 +485,369 @@ def show_messages():
     return _show_packets_or_messages(show_messages=True)
 
 
+@app.route(PREFIX + '/prometheus')
+def show_prometheus():
+    check_search_terms()
+
+    return flask.Response(
+        prometheus.get_snapshot(), content_type=prometheus.CONTENT_TYPE)
+
+
+@app.route(PREFIX + '/activity/top')
+def show_top():
+    check_search_terms(*TOP_QS_PARAMS)
+
+    args = flask.request.args
+
+    by = args.get('by', 'peer_address')
+    metric = args.get('metric', 'pdus')
+
+    try:
+        size = int(args.get('n', DEFAULT_TOP_SIZE))
+
+    except ValueError:
+        raise exceptions.BadRequest('Top size must be an integer')
+
+    if size < 1:
+        raise exceptions.BadRequest('Top size must be positive')
+
+    size = min(size, app.config['SNMPSIM_METRICS_MAX_PAGE_SIZE'])
+
+    if by == TOP_VARIATION:
+        try:
+            counter = TOP_VARIATION_METRICS[metric]
+
+        except KeyError:
+            raise exceptions.BadRequest(
+                'Variation modules can only be ranked by %s' % ', '.join(
+                    sorted(TOP_VARIATION_METRICS)))
+
+        model = models.VariationSummary
+
+        # per variation module grand totals
+        query = (
+            model
+            .query
+            .filter(model.dimension == summaries.TOTAL)
+            .filter(model.value == summaries.TOTAL)
+            .order_by(getattr(model, counter).desc(), model.name.desc()))
+
+        counters = summaries.VARIATION_SUMMARY_COUNTERS
+        key = 'name'
+
+    else:
+        try:
+            model, counter = TOP_METRICS[metric]
+
+        except KeyError:
+            raise exceptions.BadRequest(
+                'Unknown metric %s' % metric)
+
+        dimensions = (PACKETS_QS_COLUMN_MAP
+                      if model is models.PacketSummary else QS_COLUMN_MAP)
+
+        if by not in dimensions:
+            raise exceptions.BadRequest(
+                'Can not rank %s by %s' % (by, metric))
+
+        query = (
+            model
+            .query
+            .filter(model.dimension == by)
+            .order_by(getattr(model, counter).desc(), model.value.desc()))
+
+        counters = (summaries.PACKET_SUMMARY_COUNTERS
+                    if model is models.PacketSummary
+                    else summaries.MESSAGE_SUMMARY_COUNTERS)
+        key = 'value'
+
+    top = []
+
+    for row in query.limit(size).all():
+        item = {
+            counter: getattr(row, counter) or 0
+            for counter in counters
+        }
+
+        item.update(value=getattr(row, key))
+
+        top.append(item)
+
+    return {
+        'by': by,
+        'metric': metric,
+        'n': size,
+        'top': top,
+        '_links': {
+            'self': flask.url_for('show_top', by=by, metric=metric, n=size)
+        }
+    }
+
+
+def _get_series_range():
+    args = flask.request.args
+
+    try:
+        end = int(args.get('to') or time.time())
+        start = int(args.get('from') or end - DEFAULT_SERIES_SPAN)
+        step = args.get('step')
+        step = step and int(step)
+
+    except ValueError:
+        raise exceptions.BadRequest('Malformed series parameters')
+
+    if end <= start:
+        raise exceptions.BadRequest('Series must end after it starts')
+
+    try:
+        if not step:
+            # the finest step not yielding too many points
+            step = rollups.get_resolutions()[-1][0]
+
+            for resolution, _ in rollups.get_resolutions():
+                if (end - start) // resolution <= MAX_SERIES_POINTS:
+                    step = resolution
+                    break
+
+        if step <= 0:
+            raise exceptions.BadRequest('Series step must be positive')
+
+        resolution = rollups.choose_resolution(step, start)
+
+    except (error.ControlPlaneError, IndexError) as exc:
+        raise exceptions.BadRequest(
+            str(exc) or 'Metrics series are not configured')
+
+    start = start // step * step
+
+    if (end - start) // step > MAX_SERIES_POINTS:
+        raise exceptions.BadRequest(
+            'Series can not have more than %d points' % MAX_SERIES_POINTS)
+
+    return step, start, end, resolution
+
+
+def _make_series(query, counters, endpoint, fields,
+                 step, start, end, resolution):
+    metrics = {}
+
+    for row in query.all():
+        metrics[row.timestamp] = row
+
+    series = []
+
+    for timestamp in range(start, end, step):
+        row = metrics.get(timestamp)
+
+        point = {
+            counter: int(row and getattr(row, counter) or 0)
+            for counter in counters
+        }
+
+        point.update(timestamp=timestamp)
+
+        series.append(point)
+
+    args = dict(
+        (field, flask.request.args.getlist(field)) for field in fields)
+
+    args.update({'step': step, 'from': start, 'to': end})
+
+    return {
+        'step': step,
+        'from': start,
+        'to': end,
+        'resolution': resolution,
+        'series': series,
+        '_links': {
+            'self': flask.url_for(endpoint, **args)
+        }
+    }
+
+
+@app.route(PREFIX + '/activity/packets/series')
+def show_packets_series():
+    step, start, end, resolution = _get_series_range()
+
+    model = models.PacketSeries
+
+    bucket = model.timestamp - model.timestamp % step
+
+    series_query = (
+        model
+        .query
+        .filter(model.resolution == resolution)
+        .filter(model.timestamp >= start)
+        .filter(model.timestamp < end))
+
+    if set(flask.request.args).intersection(PACKETS_QS_COLUMN_MAP):
+        series_query = (
+            series_query
+            .join(models.Transport,
+                  models.Transport.id == model.transport_id))
+
+    series_query = (
+        series_query
+        .with_entities(
+            bucket.label('timestamp'),
+            *[func.sum(getattr(model, counter)).label(counter)
+              for counter in rollups.PACKET_SERIES_COUNTERS])
+        .group_by(bucket))
+
+    series_query = filter_by(
+        series_query, *PACKETS_QS_COLUMN_MAP, params=SERIES_QS_PARAMS)
+
+    return _make_series(
+        series_query, rollups.PACKET_SERIES_COUNTERS, 'show_packets_series',
+        PACKETS_QS_COLUMN_MAP, step, start, end, resolution)
+
+
+@app.route(PREFIX + '/activity/messages/series')
+def show_messages_series():
+    step, start, end, resolution = _get_series_range()
+
+    model = models.MessageSeries
+
+    bucket = model.timestamp - model.timestamp % step
+
+    series_query = (
+        model
+        .query
+        .filter(model.resolution == resolution)
+        .filter(model.timestamp >= start)
+        .filter(model.timestamp < end))
+
+    if set(flask.request.args).intersection(QS_COLUMN_MAP):
+        series_query = (
+            series_query
+            .join(models.Pdu, models.Pdu.id == model.pdu_id)
+            .join(models.Recording,
+                  models.Recording.id == models.Pdu.recording_id)
+            .join(models.Agent, models.Agent.id == models.Recording.agent_id)
+            .join(models.Transport,
+                  models.Transport.id == models.Agent.transport_id))
+
+    series_query = (
+        series_query
+        .with_entities(
+            bucket.label('timestamp'),
+            *[func.sum(getattr(model, counter)).label(counter)
+              for counter in rollups.MESSAGE_SERIES_COUNTERS])
+        .group_by(bucket))
+
+    series_query = filter_by(
+        series_query, *QS_COLUMN_MAP, params=SERIES_QS_PARAMS)
+
+    return _make_series(
+        series_query, rollups.MESSAGE_SERIES_COUNTERS, 'show_messages_series',
+        QS_COLUMN_MAP, step, start, end, resolution)
+
+
+def is_paginated():
+    return any(param in flask.request.args for param in PAGINATION_QS_PARAMS)
+
+
+def _encode_cursor(keys, row):
+    values = []
+
+    for key in keys:
+        value = getattr(row, key.key)
+        if isinstance(value, datetime.datetime):
+            value = value.isoformat()
+
+        values.append(value)
+
+    cursor = json.dumps({'after': values}).encode('utf-8')
+
+    return base64.urlsafe_b64encode(cursor).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(keys, cursor):
+    try:
+        cursor = base64.urlsafe_b64decode(
+            str(cursor + '=' * (-len(cursor) % 4)))
+        values = json.loads(cursor.decode('utf-8'))['after']
+
+        if len(values) != len(keys):
+            raise ValueError()
+
+        for idx, key in enumerate(keys):
+            if not isinstance(key.type, DateTime):
+                continue
+
+            for fmt in TIMESTAMP_FORMATS:
+                try:
+                    values[idx] = datetime.datetime.strptime(values[idx], fmt)
+                    break
+
+                except ValueError:
+                    pass
+
+            else:
+                raise ValueError()
+
+    except (TypeError, ValueError, KeyError):
+        raise exceptions.BadRequest('Malformed pagination cursor')
+
+    return values
+
+
+def paginate(query, schema, *keys):
+    """Serialize a single page of `query` results.
+
+    Rows are ordered by `keys` columns, which must uniquely identify each
+    row. The page starts right after the row identified by the `cursor`
+    query parameter and is at most `limit` rows long. The cursor to the
+    next page is linked from the response as long as there are more rows.
+    """
+    try:
+        limit = int(flask.request.args.get(
+            'limit', app.config['SNMPSIM_METRICS_MAX_PAGE_SIZE']))
+
+    except ValueError:
+        raise exceptions.BadRequest('Page limit must be an integer')
+
+    if limit < 1:
+        raise exceptions.BadRequest('Page limit must be positive')
+
+    limit = min(limit, app.config['SNMPSIM_METRICS_MAX_PAGE_SIZE'])
+
+    query = query.order_by(*keys)
+
+    cursor = flask.request.args.get('cursor')
+    if cursor:
+        query = query.filter(
+            tuple_(*keys) > tuple_(*_decode_cursor(keys, cursor)))
+
+    rows = query.limit(limit + 1).all()
+
+    links = {
+        'self': flask.url_for(
+            flask.request.endpoint, limit=limit, cursor=cursor,
+            **flask.request.view_args)
+    }
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+
+        links['next'] = flask.url_for(
+            flask.request.endpoint, limit=limit,
+            cursor=_encode_cursor(keys, rows[-1]),
+            **flask.request.view_args)
+
+    page = {
+        'items': schema(many=True).dump(rows).data,
+        '_links': links
+    }
+
+    return flask.jsonify(page), 200
+
+
 @app.route(PREFIX + '/processes')
 @app.route(PREFIX + '/processes/<id>')
 @app.route(PREFIX + '/supervisors/<supervisor_id>/processes')
 def show_processes(id=None, supervisor_id=None):
-    process_query = (
-        models.Process
-        .query
-        .outerjoin(models.Endpoint)
-        .outerjoin(models.ConsolePage))
+    process_query = models.Process.query
 
     if supervisor_id is not None:
         process_query = (
@@ -256,6 +855,10 @@ def show_processes(id=None, supervisor_id=None):
             .filter(models.Process.supervisor_id == supervisor_id))
 
     if id is None:
+        if is_paginated():
+            return paginate(
+                process_query, schemas.ProcessSchema, models.Process.id)
+
         processes = process_query.all()
 
     else:
@@ -275,12 +878,14 @@ def show_processes(id=None, supervisor_id=None):
 @app.route(PREFIX + '/supervisors')
 @app.route(PREFIX + '/supervisors/<id>')
 def show_supervisors(id=None):
-    supervisor_query = (
-        models.Supervisor
-        .query
-        .outerjoin(models.Process))
+    supervisor_query = models.Supervisor.query
 
     if id is None:
+        if is_paginated():
+            return paginate(
+                supervisor_query, schemas.SupervisorSchema,
+                models.Supervisor.id)
+
         supervisors = supervisor_query.all()
 
     else:
@@ -313,6 +918,10 @@ def show_endpoints(id=None, endpoint_id=None):
             .filter(models.Process.id == id))
 
     if endpoint_id is None:
+        if is_paginated():
+            return paginate(
+                endpoint_query, schemas.EndpointSchema, models.Endpoint.id)
+
         endpoints = endpoint_query.all()
 
     else:
@@ -329,6 +938,35 @@ def show_endpoints(id=None, endpoint_id=None):
     return schema.jsonify(endpoints), 200
 
 
+def _wait_for_rows(query, timeout):
+    deadline = time.time() + timeout
+
+    while True:
+        try:
+            current = generation.get_generation()
+
+        except error.ControlPlaneError as exc:
+            app.logger.error(exc)
+            current = None
+
+        if db.session.query(query.exists()).scalar():
+            return
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+
+        # without generation tracking, just keep polling the DB
+        if current is None:
+            time.sleep(min(remaining, CONSOLE_POLL_PERIOD))
+
+        else:
+            generation.wait(current, remaining)
+
+        # start over to see what importers have committed meanwhile
+        db.session.rollback()
+
+
 @app.route(PREFIX + '/consoles/<id>')
 @app.route(PREFIX + '/consoles/<id>/page/<page_id>')
 @app.route(PREFIX + '/processes/<id>/console')
@@ -338,11 +976,33 @@ def show_console(id, page_id=None):
         models.ConsolePage
         .query
         .join(models.Process)
-        .filter(models.Process.id == id)
-        .order_by(models.ConsolePage.timestamp.asc()))
+        .filter(models.Process.id == id))
 
     if page_id is None:
-        pages = console_query.all()
+        try:
+            since = flask.request.args.get('since')
+            if since is not None:
+                console_query = console_query.filter(
+                    models.ConsolePage.id > int(since))
+
+            wait = float(flask.request.args.get('wait', 0))
+
+        except ValueError:
+            raise exceptions.BadRequest(
+                'Console page ID and wait time must be numbers')
+
+        if wait > 0:
+            _wait_for_rows(console_query, min(wait, MAX_CONSOLE_WAIT))
+
+        if is_paginated():
+            return paginate(
+                console_query, schemas.ConsoleSchema,
+                models.ConsolePage.timestamp, models.ConsolePage.id)
+
+        pages = (
+            console_query
+            .order_by(models.ConsolePage.timestamp.asc())
+            .all())
 
     else:
         console_query = (
@@ -6,22 +6,61 @@
 #
 # SNMP Agent Simulator Control Plane: process management
 #
+import errno
+import fcntl
+import fnmatch
+import hashlib
 import os
 import select
+import signal
 import subprocess
 import time
 
+import psutil
+
+try:
+    import selectors
+
+except ImportError:
+    import selectors34 as selectors
+
+from snmpsim_control_plane import error
+from snmpsim_control_plane import inotify
 from snmpsim_control_plane import log
+from snmpsim_control_plane.supervisor.reporting import collector
 from snmpsim_control_plane.supervisor.reporting.manager import ReportingManager
 from snmpsim_control_plane.supervisor import lifecycle
 
 
 POLL_PERIOD = 1
 
+# with inotify, directory rescans only catch up with missed events
+RESCAN_PERIOD = 60
+
+# let file operations settle before looking at the file
+SETTLE_DELAY = 0.2
+
+WATCH_MASK = (inotify.IN_CREATE | inotify.IN_CLOSE_WRITE | inotify.IN_ATTRIB |
+              inotify.IN_MOVED_TO | inotify.IN_MOVED_FROM | inotify.IN_DELETE)
+
+WATCH_METHODS = ('poll', 'inotify')
+
+# crashing executables are not restarted more often than that
+RESTART_HOLDOFF = 1
+
+# seconds for a process to exit on SIGTERM before it gets SIGKILL'ed
+GRACE_PERIOD = 3
+
+# with overlapping restarts, how often to check whether new process
+# has bound its endpoints and how long to wait for it
+SWAP_CHECK_PERIOD = 0.5
+SWAP_TIMEOUT = 60
+
 STATE_ADDED = 'added'
 STATE_CHANGED = 'changed'
 STATE_RUNNING = 'running'
 STATE_REMOVED = 'removed'
+STATE_STOPPING = 'stopping'
 STATE_DIED = 'died'
 
 
@@ -41,224 +80,698 @@ def _traverse_dir(top_dir):
     return files
 
 
+def _get_digest(fl):
+    """Return executable content digest."""
+    digest = hashlib.sha256()
+
+    with open(fl, 'rb') as fd:
+        while True:
+            chunk = fd.read(64 * 1024)
+            if not chunk:
+                break
+
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def _set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+def _read(fd, size):
+    """Read from non-blocking `fd`, return `None` if nothing is there."""
+    try:
+        return os.read(fd, size)
+
+    except OSError as exc:
+        if exc.errno in (errno.EAGAIN, errno.EINTR):
+            return
+
+        raise
+
+
+def _open_wakeup_pipe():
+    """Make SIGCHLD wake up the main loop.
+
+    Returns the read end of the pipe each SIGCHLD is written into.
+    """
+    r, w = os.pipe()
+
+    _set_nonblocking(r)
+    _set_nonblocking(w)
+
+    signal.set_wakeup_fd(w)
+
+    # wakeup fd is only written into if signal has a Python handler
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    return r
+
+
 def _run_process(fl, fd):
     try:
         return subprocess.Popen(
-            [fl], stdout=fd, stderr=fd)
+            [fl], stdout=fd, stderr=fd, close_fds=True)
 
     except Exception as exc:
         log.error('Executable %s failed to start: %s' % (fl, exc))
 
 
-def _kill_process(leash):
-    leash.terminate()
+def _get_grace_period(fl, grace_periods):
+    """Return grace period for executable `fl`.
 
-    time.sleep(3)
+    The `grace_periods` is a sequence of `(pattern, seconds)` pairs,
+    the first shell pattern matching executable path wins. Pattern
+    of `None` sets the default grace period.
+    """
+    default = GRACE_PERIOD
 
-    if leash.returncode is None:
-        log.error(
-            'Process %s did not stop gracefully, killing...' % leash.pid)
-        leash.kill()
-        leash.wait()
+    for pattern, seconds in grace_periods:
+        if pattern is None:
+            default = seconds
 
+        elif fnmatch.fnmatch(fl, pattern):
+            return seconds
 
-def _process_is_running(leash):
-    if leash:
-        leash.poll()
-        return leash.returncode is None
+    return default
 
 
-def manage_executables(watch_dir):
-    known_instances = {}
+def _read_console(instance):
+    """Collect and log process output.
 
-    log.info('Watching directory %s' % watch_dir)
+    Returns `False` once process output is over.
+    """
+    executable = instance['executable']
+    console = instance['console']
 
-    while True:
-        # Collect and log processes output
+    try:
+        page_text = _read(instance['pipe'], console.MAX_CONSOLE_SIZE)
 
-        rlist = {x['pipe'][0]: x['executable']
-                 for x in known_instances.values()
-                 if x['state'] == STATE_RUNNING}
+    except OSError as exc:
+        log.error(exc)
+        return False
 
-        while True:
-            try:
-                r, w, x = select.select(rlist, [], [], 0.1)
+    if page_text is None:
+        return True
 
-            except Exception as exc:
-                log.error(exc)
-                break
+    if not page_text:
+        return False
 
-            if not r:
-                break
+    log.msg('Output from process "%s" begins' % executable)
+
+    page_text = page_text.decode(errors='ignore')
+
+    console.add(page_text, int(time.time()))
+
+    log.msg(page_text)
+    log.msg('Output from process "%s" ends' % executable)
+
+    return True
+
+
+def _close_console(selector, instance):
+    fd = instance['pipe']
+    if fd is None:
+        return
+
+    # whatever process has written so far
+    while _read_console(instance):
+        if not select.select([fd], [], [], 0)[0]:
+            break
+
+    selector.unregister(fd)
+
+    try:
+        os.close(fd)
 
-            timestamp = int(time.time())
+    except OSError as exc:
+        log.error(exc)
 
-            for fd in r:
-                executable = rlist[fd]
-                instance = known_instances[executable]
-                console = instance['console']
+    instance['pipe'] = None
 
-                log.msg('Output from process "%s" begins' % executable)
 
-                page_text = os.read(fd, console.MAX_CONSOLE_SIZE)
-                page_text = page_text.decode(errors='ignore')
+def _reap_children(known_instances):
+    now = time.time()
 
-                console.add(page_text, timestamp)
+    for fl, instance in known_instances.items():
+        if instance['state'] != STATE_RUNNING:
+            continue
+
+        leash = instance['leash']
+
+        if leash.poll() is None:
+            continue
+
+        instance['state'] = STATE_DIED
+        instance['stopped'] = now
+        instance['exits'] += 1
+
+        uptime = int(now - instance['started'])
+
+        log.info(
+            'Executable %s (PID %s) has died '
+            '(rc=%s), uptime %s' % (fl, leash.pid, leash.returncode, uptime))
+
+
+def _update_executable(fl, known_instances):
+    stat = os.stat(fl)
+
+    # file content can not be any different unless any of these changes
+    stat = stat.st_ino, stat.st_size, stat.st_mtime
+
+    instance = known_instances.get(fl)
+
+    if instance and instance['state'] == STATE_REMOVED:
+        # came back before its process has been stopped
+        instance['state'] = STATE_CHANGED
+
+    elif instance and instance['state'] == STATE_STOPPING:
+        instance['restart'] = True
+
+    if instance and instance['file_stat'] == stat:
+        return
+
+    try:
+        digest = _get_digest(fl)
+
+    except IOError as exc:
+        if exc.errno != errno.EACCES:
+            raise
+
+        # execute-only file, all we know is its stat
+        digest = stat
+
+    if not instance:
+        instance = {
+            'pid': 0,
+            'executable': fl,
+            'file_info': digest,
+            'file_stat': stat,
+            'leash': None,
+            'pipe': None,
+            'state': STATE_ADDED,
+            'created': time.time(),
+            'started': None,
+            'stopped': None,
+            'next_start': 0,
+            'stop_deadline': None,
+            'restart': False,
+            'swap': None,
+            'no_overlap': False,
+            'runtime': lifecycle.Counter(0),
+            'changes': lifecycle.Counter(0),
+            'exits': lifecycle.Counter(0),
+            'swap_latency': lifecycle.Gauge(0),
+            'console': lifecycle.ConsoleLog(),
+        }
+        known_instances[fl] = instance
+
+        log.info('Start tracking executable %s' % fl)
+
+        return
+
+    instance['file_stat'] = stat
+
+    pid = instance['leash'].pid if instance['leash'] else '?'
+
+    if instance['file_info'] == digest:
+        log.debug('Existing executable %s (PID %s) has been rewritten '
+                  'with the same content' % (fl, pid))
+
+    else:
+        instance['file_info'] = digest
+        instance['changes'] += 1
+
+        if instance['state'] != STATE_STOPPING:
+            instance['state'] = STATE_CHANGED
 
-                log.msg(page_text)
-                log.msg('Output from process "%s" ends' % executable)
+        log.info('Existing executable %s (PID %s) has '
+                 'changed' % (fl, pid))
 
-        # Watch executables
 
-        existing_files = set()
+def _remove_executable(fl, known_instances):
+    instance = known_instances[fl]
 
+    if instance['state'] == STATE_REMOVED:
+        return
+
+    if instance['state'] == STATE_STOPPING:
+        if not instance['restart']:
+            return
+
+        instance['restart'] = False
+
+    else:
+        instance['state'] = STATE_REMOVED
+
+    instance['changes'] += 1
+
+    log.info(
+        'Existing executable %s (PID %s) has been '
+        'removed' % (fl, instance['pid']))
+
+
+def _check_executable(fl, known_instances):
+    """Update executable state from what is now at `fl` path."""
+    try:
+        if os.path.isfile(fl) and os.access(fl, os.X_OK):
+            _update_executable(fl, known_instances)
+            return
+
+    except (IOError, OSError):
+        pass
+
+    if fl in known_instances:
+        _remove_executable(fl, known_instances)
+
+
+def _scan_dir(watch_dir, known_instances):
+    existing_files = set()
+
+    for fl in _traverse_dir(watch_dir):
         try:
-            files = _traverse_dir(watch_dir)
+            _update_executable(fl, known_instances)
 
-        except Exception as exc:
-            log.error('Directory %s traversal failure: %s' % (watch_dir, exc))
-            time.sleep(10)
+        except (IOError, OSError):
+            # gone meanwhile
             continue
 
-        for fl in files:
-            instance = known_instances.get(fl)
+        existing_files.add(fl)
+
+    for fl in set(known_instances) - existing_files:
+        _remove_executable(fl, known_instances)
+
+
+def _start_process(selector, instance):
+    fl = instance['executable']
+
+    _close_console(selector, instance)
+
+    instance['next_start'] = time.time() + RESTART_HOLDOFF
+
+    r, w = os.pipe()
+
+    leash = _run_process(fl, w)
+
+    os.close(w)
+
+    if not leash:
+        os.close(r)
+        return
+
+    _set_nonblocking(r)
+
+    selector.register(r, selectors.EVENT_READ, instance)
+
+    instance['leash'] = leash
+    instance['pipe'] = r
+    instance['state'] = STATE_RUNNING
+    instance['started'] = time.time()
+    instance['pid'] = leash.pid
+    instance['no_overlap'] = False
 
-            stat = os.stat(fl).st_mtime
+    log.info(
+        'Executable %s (PID %s) has been '
+        'started' % (fl, leash.pid))
 
-            if not instance:
-                instance = {
-                    'pid': 0,
-                    'executable': fl,
-                    'file_info': stat,
-                    'leash': None,
-                    'pipe': (None, None),
-                    'state': STATE_ADDED,
-                    'created': time.time(),
-                    'started': None,
-                    'stopped': None,
-                    'runtime': lifecycle.Counter(0),
-                    'changes': lifecycle.Counter(0),
-                    'exits': lifecycle.Counter(0),
-                    'console': lifecycle.ConsoleLog(),
-                }
-                known_instances[fl] = instance
 
-                log.info('Start tracking executable %s' % fl)
+def _stop_process(instance, grace_periods):
+    """Ask process to terminate, do not wait for it to exit."""
+    fl = instance['executable']
+    leash = instance['leash']
 
-            pid = instance['leash'].pid if instance['leash'] else '?'
+    instance['restart'] = instance['state'] == STATE_CHANGED
+    instance['state'] = STATE_STOPPING
+    instance['stop_deadline'] = (
+        time.time() + _get_grace_period(fl, grace_periods))
 
-            if instance['file_info'] != stat:
-                instance['file_info'] = stat
-                instance['state'] = STATE_CHANGED
-                instance['changes'] += 1
+    try:
+        leash.terminate()
+
+    except OSError as exc:
+        log.error(exc)
+
+    log.info(
+        'Executable %s (PID %s) is being '
+        'stopped' % (fl, leash.pid))
+
+
+def _check_stopping(instance):
+    """Tell whether stopping process has exited, kill it if it's late."""
+    leash = instance['leash']
+
+    if leash.poll() is not None:
+        log.info(
+            'Executable %s (PID %s) has been '
+            'stopped' % (instance['executable'], leash.pid))
+        return True
+
+    if (instance['stop_deadline'] is not None and
+            instance['stop_deadline'] <= time.time()):
+        log.error(
+            'Process %s did not stop gracefully, killing...' % leash.pid)
+
+        try:
+            leash.kill()
+
+        except OSError as exc:
+            log.error(exc)
+
+        # SIGCHLD will tell when it's gone
+        instance['stop_deadline'] = None
+
+    return False
+
+
+def _get_endpoints(pid):
+    try:
+        endpoints = collector.get_endpoints(psutil.Process(pid))
+
+    except psutil.Error as exc:
+        log.error(exc)
+        return set()
+
+    return set((protocol, address)
+               for protocol, addresses in endpoints.items()
+               for address in addresses)
+
+
+def _begin_swap(selector, instance):
+    """Start new process while the old one keeps running."""
+    old = dict(instance)
+
+    if old['pipe'] is not None:
+        selector.modify(old['pipe'], selectors.EVENT_READ, old)
+
+    instance['leash'] = None
+    instance['pipe'] = None
+
+    instance['swap'] = {
+        'old': old,
+        'endpoints': _get_endpoints(old['pid']),
+        'started': time.time(),
+        'next_check': time.time()
+    }
+
+    log.info(
+        'Executable %s (PID %s) is being swapped' % (
+            instance['executable'], old['pid']))
+
+    _start_process(selector, instance)
+
+    if not instance['leash']:
+        _abort_swap(selector, instance)
+
+
+def _abort_swap(selector, instance):
+    """Bring old process back, to be stopped before new one starts."""
+    old = instance['swap']['old']
+
+    instance['swap'] = None
+
+    _close_console(selector, instance)
+
+    for key in ('leash', 'pipe', 'pid', 'started'):
+        instance[key] = old[key]
+
+    if instance['pipe'] is not None:
+        selector.modify(instance['pipe'], selectors.EVENT_READ, instance)
+
+    instance['state'] = STATE_CHANGED
+    instance['no_overlap'] = True
+
+    log.error(
+        'Executable %s (PID %s) could not be swapped, restarting '
+        'it' % (instance['executable'], instance['pid']))
+
+
+def _retire(instance, retiring, grace_periods):
+    """Stop the process new one has replaced."""
+    old = instance['swap']['old']
+
+    instance['swap'] = None
+
+    old['state'] = STATE_REMOVED
+
+    _stop_process(old, grace_periods)
+
+    retiring.append(old)
+
+
+def _check_swap(instance, retiring, grace_periods):
+    """Retire old process once new one has bound old one's endpoints."""
+    swap = instance['swap']
+
+    now = time.time()
+
+    swap['next_check'] = now + SWAP_CHECK_PERIOD
+
+    endpoints = _get_endpoints(instance['pid'])
+
+    if endpoints and endpoints.issuperset(swap['endpoints']):
+        latency = now - swap['started']
+
+        instance['swap_latency'] = lifecycle.Gauge(int(latency * 1000))
+
+        log.info(
+            'Executable %s (PID %s) has bound its endpoints in %.2f '
+            'sec' % (instance['executable'], instance['pid'], latency))
+
+    elif now - swap['started'] >= SWAP_TIMEOUT:
+        log.error(
+            'Executable %s (PID %s) has not bound its endpoints in %d '
+            'sec' % (instance['executable'], instance['pid'], SWAP_TIMEOUT))
 
-                log.info('Existing executable %s (PID %s) has '
-                         'changed' % (fl, pid))
+    else:
+        return
 
-            if instance['state'] == STATE_RUNNING:
-                executable = instance['leash']
+    _retire(instance, retiring, grace_periods)
 
-                executable.poll()
 
-                if executable.returncode is not None:
-                    instance['state'] = STATE_DIED
-                    instance['stopped'] = time.time()
-                    instance['exits'] += 1
+def _run_executables(selector, known_instances, retiring, grace_periods=(),
+                     overlap=False):
+    """Start, restart and stop processes as their executables' states say.
 
-                    uptime = int(
-                        time.time() - instance['started'] or time.time())
+    Processes are stopped asynchronously: first they get SIGTERM, those
+    still running once their grace period is over get SIGKILL.
 
-                    log.info(
-                        'Executable %s (PID %s) has died '
-                        '(rc=%s), uptime %s' % (fl, pid, executable.returncode,
-                                                uptime))
+    With `overlap`, changed executable's new process is started first.
+    The old one is moved into `retiring` list and stopped once the new
+    one binds all the endpoints the old one has had. Should the new
+    process fail, the old one is stopped before starting the new one
+    again.
 
-            existing_files.add(fl)
+    Returns the time of the earliest pending restart, stop deadline or
+    swap check, if any.
+    """
+    for old in tuple(retiring):
+        if _check_stopping(old):
+            _close_console(selector, old)
+            retiring.remove(old)
 
-        removed_files = set(known_instances) - existing_files
+    for fl, instance in tuple(known_instances.items()):
+        if instance['swap']:
+            if instance['state'] in (STATE_CHANGED, STATE_REMOVED):
+                _retire(instance, retiring, grace_periods)
 
-        for fl in removed_files:
-            instance = known_instances[fl]
-            instance['state'] = STATE_REMOVED
-            instance['changes'] += 1
+            elif instance['state'] == STATE_DIED:
+                _abort_swap(selector, instance)
+
+            elif instance['swap']['next_check'] <= time.time():
+                _check_swap(instance, retiring, grace_periods)
+
+        state = instance['state']
+
+        if state in (STATE_ADDED, STATE_DIED):
+            if instance['next_start'] <= time.time():
+                _start_process(selector, instance)
+
+            continue
+
+        if state in (STATE_CHANGED, STATE_REMOVED):
+            leash = instance['leash']
+
+            if leash and leash.poll() is None:
+                if (state == STATE_CHANGED and overlap and
+                        not instance['no_overlap']):
+                    _begin_swap(selector, instance)
+
+                    if instance['swap']:
+                        continue
+
+                _stop_process(instance, grace_periods)
+
+            else:
+                instance['restart'] = state == STATE_CHANGED
+                instance['state'] = STATE_STOPPING
+
+        if instance['state'] != STATE_STOPPING:
+            continue
+
+        if instance['leash'] and not _check_stopping(instance):
+            continue
+
+        _close_console(selector, instance)
+
+        if instance['restart']:
+            instance['state'] = STATE_DIED
+
+            if instance['next_start'] <= time.time():
+                _start_process(selector, instance)
+
+        else:
+            known_instances.pop(fl)
 
             log.info(
-                'Existing executable %s (PID %s) has been '
-                'removed' % (fl, instance['pid']))
+                'Stopped tracking executable %s' % fl)
+
+    deadlines = [old['stop_deadline'] for old in retiring]
 
-        for fl, instance in tuple(known_instances.items()):
-            state = instance['state']
+    for instance in known_instances.values():
+        if instance['state'] in (STATE_ADDED, STATE_DIED):
+            deadlines.append(instance['next_start'])
 
-            if state in (STATE_ADDED, STATE_DIED):
-                if state == STATE_DIED:
-                    r, w = instance['pipe']
+        elif instance['state'] == STATE_STOPPING:
+            deadlines.append(instance['stop_deadline'])
 
-                    try:
-                        os.close(r)
-                        os.close(w)
+        if instance['swap']:
+            deadlines.append(instance['swap']['next_check'])
 
-                    except OSError as exc:
-                        log.error(exc)
+    deadlines = [deadline for deadline in deadlines if deadline is not None]
 
-                r, w = os.pipe()
+    return min(deadlines) if deadlines else None
 
-                leash = _run_process(fl, w)
 
-                instance['leash'] = leash
-                instance['pipe'] = r, w
+def _report_metrics(watch_dir, known_instances):
+    now = time.time()
 
-                if leash:
-                    instance['state'] = STATE_RUNNING
-                    instance['started'] = time.time()
-                    instance['pid'] = leash.pid
+    if ReportingManager.deadline() > now:
+        return
 
-                    log.info(
-                        'Executable %s (PID %s) has been '
-                        'started' % (fl, leash.pid))
+    for instance in known_instances.values():
+        if instance['state'] == STATE_RUNNING:
+            instance['runtime'] = lifecycle.Counter(
+                now - instance['created'])
 
-            elif state in (STATE_CHANGED, STATE_REMOVED):
-                leash = instance['leash']
+    ReportingManager.process_metrics(watch_dir, *known_instances.values())
 
-                if leash:
-                    _kill_process(leash)
 
-                    log.info(
-                        'Executable %s (PID %s) has been '
-                        'stopped' % (fl, leash.pid))
+def manage_executables(watch_dir, method='poll', grace_periods=(),
+                       overlap=False):
+    """Keep executables found in `watch_dir` running.
+
+    The supervisor sleeps until a process exits (as SIGCHLD tells),
+    writes to its console or a timer fires. Exited processes get
+    restarted right away, though not more often than once in
+    `RESTART_HOLDOFF` seconds.
+
+    The `poll` method rescans the whole directory tree every
+    `POLL_PERIOD` seconds. The `inotify` method only looks at the files
+    Linux inotify reports as created, written, moved, removed or having
+    their permissions changed, the whole tree is rescanned every
+    `RESCAN_PERIOD` seconds.
+
+    Processes are stopped without blocking the supervisor. Each one is
+    given its grace period (as `grace_periods` configure) to exit on
+    SIGTERM before it is SIGKILL'ed.
+
+    With `overlap`, processes of changed executables are swapped with
+    no downtime: the new process is started first, the old one is only
+    stopped once the new one has bound its endpoints.
+    """
+    if method not in WATCH_METHODS:
+        raise error.ControlPlaneError(
+            'Unknown directory watch method %s' % method)
+
+    known_instances = {}
 
-                r, w = instance['pipe']
-                if r:
-                    try:
-                        os.close(r)
-                        os.close(w)
+    # old processes of swapped executables
+    retiring = []
+
+    log.info('Watching directory %s using %s' % (watch_dir, method))
+
+    selector = selectors.DefaultSelector()
+
+    selector.register(_open_wakeup_pipe(), selectors.EVENT_READ)
+
+    watcher = None
+    scan_period = POLL_PERIOD
+
+    if method == 'inotify':
+        watcher = inotify.TreeWatcher(watch_dir, WATCH_MASK)
+
+        selector.register(watcher, selectors.EVENT_READ, watcher)
+
+        scan_period = RESCAN_PERIOD
+
+    # file paths to look at once file operations settle
+    pending = {}
+
+    next_scan = time.time()
+
+    while True:
+        if next_scan <= time.time():
+            try:
+                _scan_dir(watch_dir, known_instances)
+
+                next_scan = time.time() + scan_period
+
+            except Exception as exc:
+                log.error(
+                    'Directory %s traversal failure: %s' % (watch_dir, exc))
+                next_scan = time.time() + 10
+
+        now = time.time()
+
+        for fl in [fl for fl in pending if pending[fl] <= now]:
+            pending.pop(fl)
+            _check_executable(fl, known_instances)
+
+        next_run = _run_executables(
+            selector, known_instances, retiring, grace_periods, overlap)
+
+        _report_metrics(watch_dir, known_instances)
+
+        deadlines = [next_scan, ReportingManager.deadline()]
+
+        if next_run:
+            deadlines.append(next_run)
+
+        if pending:
+            deadlines.append(min(pending.values()))
+
+        timeout = max(0, min(deadlines) - time.time())
+
+        try:
+            events = selector.select(timeout)
 
-                    except OSError as exc:
-                        log.error(exc)
+        except (OSError, select.error) as exc:
+            if exc.args[0] != errno.EINTR:
+                raise
 
-                if state == STATE_CHANGED:
-                    instance['state'] = STATE_DIED
+            events = []
 
-                else:
-                    known_instances.pop(fl)
+        for key, mask in events:
+            if key.data is None:
+                # drain SIGCHLD notifications
+                while _read(key.fd, 512):
+                    pass
 
-                    log.info(
-                        'Stopped tracking executable %s' % fl)
+                _reap_children(known_instances)
 
-            elif state == STATE_RUNNING:
-                leash = instance['leash']
-                if _process_is_running(leash):
-                    now = time.time()
-                    instance['runtime'] = lifecycle.Counter(
-                        now - instance['created'])
+            elif key.data is watcher:
+                settled = time.time() + SETTLE_DELAY
 
-                else:
-                    instance['state'] = STATE_DIED
-                    instance['exits'] += 1
+                for path, mask in watcher.read_events(0):
 
-                    log.info('Executable %s (PID %s) has '
-                             'died' % (fl, leash.pid))
+                    # events might have been missed, rescan the tree
+                    if mask & (inotify.IN_Q_OVERFLOW | inotify.IN_ISDIR):
+                        next_scan = min(next_scan, settled)
 
-        ReportingManager.process_metrics(
-            watch_dir, *known_instances.values())
+                    else:
+                        pending[path] = settled
 
-        time.sleep(POLL_PERIOD)
+            elif not _read_console(key.data):
+                _close_console(selector, key.data)
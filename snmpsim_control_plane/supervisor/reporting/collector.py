@@ -26,10 +26,27 @@ LIFECYCLE_METRICS = (
     'runtime',
     'exits',
     'changes',
+    'swap_latency',
     'console'
 )
 
 
+def get_endpoints(process):
+    """Return network endpoints bound by `psutil.Process`.
+
+    Endpoint addresses are grouped by transport protocol.
+    """
+    endpoints = collections.defaultdict(list)
+
+    for kind in ENDPOINT_MAP:
+        for conn in process.connections(kind):
+            endpoints[ENDPOINT_MAP[kind]].append(
+                '%s:%s' % (conn.laddr.ip, conn.laddr.port)
+            )
+
+    return endpoints
+
+
 def collect_metrics(*instances):
     """Collect process metrics.
 
@@ -48,6 +65,8 @@ def collect_metrics(*instances):
             'exits': 0,  # number of unexpected exits (cumulative)
             'restarts': 0,  # number of restarts because of changes
                             # (cumulative)
+            'swap_latency': 0,  # how long the last overlapping restart
+                                # took (ms, gauge)
             'endpoints': {  # allocated network endpoints (gauge)
                 'udpv4': [
                     '127.0.0.1:161',
@@ -74,26 +93,12 @@ def collect_metrics(*instances):
 
             process_info = process.as_dict()
 
-            endpoints = collections.defaultdict(list)
-
-            for kind in ENDPOINT_MAP:
-                for conn in process.connections(kind):
-                    endpoints[ENDPOINT_MAP[kind]].append(
-                        '%s:%s' % (conn.laddr.ip, conn.laddr.port)
-                    )
+            endpoints = get_endpoints(process)
 
         except psutil.Error as exc:
             log.error(exc)
             continue
 
-        endpoints = collections.defaultdict(list)
-
-        for kind in ENDPOINT_MAP:
-            for conn in process.connections(kind):
-                endpoints[ENDPOINT_MAP[kind]].append(
-                    '%s:%s' % (conn.laddr.ip, conn.laddr.port)
-                )
-
         metrics = {
             'memory': lifecycle.Gauge(
                 process_info['memory_info'].vms // 1024 // 1024),
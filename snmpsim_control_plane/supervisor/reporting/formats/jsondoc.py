@@ -43,6 +43,7 @@ class JsonDocReporter(base.BaseReporter):
                 'files': 0,
                 'exits': 0,
                 'changes': 0,
+                'swap_latency': 0,
                 'endpoints': {
                     'udpv4': [
                         '127.0.0.1:161'
@@ -41,7 +41,7 @@ class ReportingManager(object):
 
     _reporter = null.NullReporter()
 
-    _next_dump = time.time() + REPORTING_PERIOD
+    _next_dump = STARTED + REPORTING_PERIOD
 
     @classmethod
     def configure(cls, fmt, *args):
@@ -57,6 +57,11 @@ class ReportingManager(object):
         log.info('Using "%s" activity reporting method with '
                  'params %s' % (cls._reporter, ', '.join(args)))
 
+    @classmethod
+    def deadline(cls):
+        """Time by which `process_metrics` should be called."""
+        return cls._next_dump
+
     @classmethod
     def process_metrics(cls, watch_dir, *instances):
         now = int(time.time())